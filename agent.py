@@ -3,17 +3,42 @@
 介绍： LangGraph Agent（核心调度） - 实现 Plan and Execute 模式
 """
 
-from typing import Dict, List, Any
+from typing import Callable, Dict, List, Any, Optional
+import asyncio
+import hashlib
+import os
+import queue
+import threading
+from dataclasses import replace
+from datetime import datetime, timezone
 from langgraph.graph import StateGraph, END
+from langgraph.types import Send
 import tkinter as tk
 from tkinter import messagebox, scrolledtext
 
-from utils.nodes import AgentState, plan_node, execute_node, replan_node
-from utils.memory import (
-    history, summary, update_summary,
-    add_message, transfer_memory, get_context
-)
+from utils.nodes import AgentState, plan_node, execute_node, replan_node, independent_steps, is_failed_result
+from utils import plan_cache
+from utils.memory import update_summary, add_message, transfer_memory, get_context
 from utils.mcp import create_local_mcp_server, setup_local_mcp_client
+from tools.get_current_time import reset_time_snapshot
+from tools.akshare_search import warm_identity_index
+from llm.ollama_client import close_async_client
+
+# 尝试导入LangGraph的SQLite检查点（可选依赖 langgraph-checkpoint-sqlite）
+try:
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+    has_checkpointer = True
+except ImportError:
+    has_checkpointer = False
+
+CHECKPOINT_DB_PATH = os.environ.get("AGENT_CHECKPOINT_PATH", "agent_state.db")
+# 检查点有效期（秒，环境变量 AGENT_CHECKPOINT_TTL）：超过有效期的执行记录不再复用或恢复，行情等结果会过时
+CHECKPOINT_TTL = float(os.environ.get("AGENT_CHECKPOINT_TTL", "600"))
+
+
+def checkpoint_enabled() -> bool:
+    """是否启用状态检查点（环境变量 AGENT_CHECKPOINT=1 且已安装 langgraph-checkpoint-sqlite）"""
+    return has_checkpointer and os.environ.get("AGENT_CHECKPOINT") == "1"
 
 
 # 主Agent类
@@ -21,7 +46,7 @@ class PlanExecuteAgent:
     def __init__(self):
         self.graph = self._build_graph()
     
-    def _build_graph(self):
+    def _build_graph(self, checkpointer=None):
         """构建状态图"""
         # 创建状态图
         graph = StateGraph(AgentState)
@@ -34,28 +59,34 @@ class PlanExecuteAgent:
         # 设置第一个被调用的节点
         graph.set_entry_point("plan")
         
-        # 定义条件边
-        def should_continue(state: AgentState):
+        # 定义条件边：把一批互不依赖的步骤通过Send并行分发给execute节点
+        def dispatch_steps(state: AgentState):
             if state.completed:
                 return END
-            # 每执行一步就进入replan检查
-            if state.current_step < len(state.current_plan):
-                # 执行一步后进入replan
-                if state.current_step > 0:  # 不是第一步
-                    return "replan"
-                # 第一步执行完也要检查
-                return "execute" if state.current_step == 0 else "replan"
-            return "replan"
+            batch = independent_steps(state)
+            if not batch:
+                # 没有待执行的步骤，由replan生成最终答案
+                return "replan"
+            return [Send("execute", replace(state, current_step=i)) for i in batch]
         
-        graph.add_conditional_edges("plan", should_continue)
-        graph.add_conditional_edges("execute", should_continue)
-        graph.add_conditional_edges("replan", should_continue)
+        graph.add_conditional_edges("plan", dispatch_steps, ["execute", "replan", END])
+        graph.add_edge("execute", "replan")
+        graph.add_conditional_edges("replan", dispatch_steps, ["execute", "replan", END])
         
         # 编译图
-        return graph.compile()
+        return graph.compile(checkpointer=checkpointer)
     
-    def run(self, user_input: str) -> Dict[str, Any]:
-        """运行Agent处理用户输入"""
+    def run(self, user_input: str, on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        运行Agent处理用户输入
+        
+        Args:
+            user_input: 用户输入
+            on_token: 最终答案流式生成时的回调，每收到一段文本调用一次（可选）
+        """
+        # 每次运行使用新的时间快照
+        reset_time_snapshot()
+        
         # 将用户输入添加到记忆系统
         add_message("user", user_input)
         
@@ -69,7 +100,9 @@ class PlanExecuteAgent:
             current_step=0,
             execution_results=[],
             completed=False,
-            final_answer=None
+            final_answer=None,
+            # 查找相似目标的计划模板，命中时plan节点跳过完整规划
+            plan_template=plan_cache.lookup(user_input) if plan_cache.plan_cache_enabled() else None
         )
         
         print(f"\n{'='*50}")
@@ -77,7 +110,7 @@ class PlanExecuteAgent:
         print(f"{'='*50}")
         
         # 执行图并输出过程信息
-        result = self._execute_with_console_output(initial_state)
+        result = self._execute_with_console_output(initial_state, on_token)
         
         # 将AI回复添加到记忆系统
         # todo 现在设计的是只要是final answer就更新摘要和长期记忆
@@ -87,91 +120,106 @@ class PlanExecuteAgent:
             update_summary("PlanExecuteAgent")
             # 转移到长期记忆
             transfer_memory()
+            # 缓存成功执行的计划模板（有步骤失败的计划不缓存）
+            if plan_cache.plan_cache_enabled() and not any(
+                is_failed_result(res['result']) for res in result['execution_results']
+            ):
+                plan_cache.store_plan(user_input, result['current_plan'])
         
         return result
     
-    def _execute_with_console_output(self, initial_state: AgentState) -> Dict[str, Any]:
-        """执行带有控制台输出的版本 - 实现标准Plan and Execute流程（每步执行后检查）"""
-        current_state = initial_state
-        step_count = 0
+    def _execute_with_console_output(self, initial_state: AgentState, on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """执行状态图并输出结果 - plan -> execute（同一批步骤并行） -> replan 的调度由LangGraph完成"""
+        # 节点均为异步函数，同一批Send分发的步骤在事件循环中并发执行（LLM调用与工具调用互相重叠）
+        result = asyncio.run(self._arun(initial_state, on_token))
+        final_state = self._update_state(initial_state, result)
         
-        # 第一步必须是plan
-        print(f"\n--- 第 1 步: 执行 plan 节点 ---")
-        result_dict = plan_node(current_state)
-        current_state = self._update_state(current_state, result_dict)
-        self._display_plan(current_state)
-        step_count = 1
-        
-        # 主循环：执行execute -> replan -> execute -> replan ...
-        while True:
-            step_count += 1
-            
-            # 执行execute步骤
-            print(f"\n--- 第 {step_count} 步: 执行 execute 节点 ---")
-            result_dict = execute_node(current_state)
-            current_state = self._update_state(current_state, result_dict)
-            self._display_execution_result(current_state)
-            
-            step_count += 1
-            
-            # 立即执行replan检查
-            print(f"\n--- 第 {step_count} 步: 执行 replan 节点 ---")
-            result_dict = replan_node(current_state)
-            current_state = self._update_state(current_state, result_dict)
-            
-            # 检查replan结果
-            if current_state.final_answer:
-                print(f"\n🎯 最终答案: {current_state.final_answer}")
-                print(f"\n✅ 执行完成！总共执行了 {step_count} 步")
-                break
-            elif current_state.completed:
-                print(f"\n✅ 执行完成！总共执行了 {step_count} 步")
-                break
-            else:
-                self._display_replan_info(current_state)
-                # 继续下一轮execute-replan循环
-                continue
+        if final_state.final_answer:
+            print(f"\n🎯 最终答案: {final_state.final_answer}")
+        print(f"\n✅ 执行完成！总共执行了 {len(final_state.execution_results)} 个步骤")
         
         # 返回最终结果
         return {
-            'current_plan': current_state.current_plan,
-            'current_step': current_state.current_step,
-            'execution_results': current_state.execution_results,
-            'completed': current_state.completed,
-            'final_answer': current_state.final_answer
+            'current_plan': final_state.current_plan,
+            'current_step': final_state.current_step,
+            'execution_results': final_state.execution_results,
+            'completed': final_state.completed,
+            'final_answer': final_state.final_answer
         }
     
-    def _determine_next_action(self, state: AgentState) -> str:
-        """确定下一步动作 - 确保正确的Plan and Execute流程"""
-        if state.completed:
-            return "END"
-        
-        # 如果还没有计划，先执行plan
-        if not state.current_plan:
-            return "plan"
-        
-        # 如果还有未执行的步骤，执行execute
-        if state.current_step < len(state.current_plan):
-            return "execute"
+    async def _arun(self, initial_state: AgentState, on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """执行状态图，结束时关闭本次事件循环中创建的LLM异步客户端（每条消息都在新的事件循环中运行）"""
+        try:
+            return await self._arun_graph(initial_state, on_token)
+        finally:
+            await close_async_client()
+    
+    async def _arun_graph(self, initial_state: AgentState, on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """执行状态图；启用检查点时按用户输入复用有效期内已完成的结果或从中断处恢复，否则在新的线程中执行"""
+        config = {"recursion_limit": 100}
+        if not checkpoint_enabled():
+            return await self._astream(self.graph, initial_state, config, on_token)
         
-        # 如果所有步骤都执行完了，执行replan来生成最终答案
-        return "replan"
-
+        thread_id = hashlib.sha256(initial_state.user_input.encode("utf-8")).hexdigest()
+        config["configurable"] = {"thread_id": thread_id}
+        async with AsyncSqliteSaver.from_conn_string(CHECKPOINT_DB_PATH) as saver:
+            graph = self._build_graph(checkpointer=saver)
+            snapshot = await graph.aget_state(config)
+            if snapshot.values and self._checkpoint_fresh(snapshot.created_at):
+                if snapshot.values.get("completed") and snapshot.values.get("final_answer"):
+                    print("命中已完成的执行记录，直接返回结果")
+                    return snapshot.values
+                if snapshot.next:
+                    # 上次执行中断，从最近的检查点继续，跳过已完成的步骤
+                    print("从检查点恢复未完成的执行")
+                    return await self._astream(graph, None, config, on_token)
+            if snapshot.values:
+                # 不复用也不恢复时清空该线程的旧记录，否则累加型字段（execution_results等）会带入上次的步骤结果
+                await saver.adelete_thread(thread_id)
+            return await self._astream(graph, initial_state, config, on_token)
+    
+    @staticmethod
+    def _checkpoint_fresh(created_at: Optional[str]) -> bool:
+        """检查点是否仍在有效期内（created_at为检查点写入时的ISO格式UTC时间）"""
+        if not created_at:
+            return False
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(created_at)
+        return age.total_seconds() <= CHECKPOINT_TTL
+    
+    async def _astream(self, graph, graph_input, config: Dict[str, Any], on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """流式执行状态图，每个节点完成时输出过程信息，最终答案的文本片段交给on_token，返回最终状态"""
+        final_values = {}
+        async for mode, chunk in graph.astream(graph_input, config=config, stream_mode=["updates", "custom", "values"]):
+            if mode == "values":
+                final_values = chunk
+                continue
+            if mode == "custom":
+                if on_token and "final_answer_chunk" in chunk:
+                    on_token(chunk["final_answer_chunk"])
+                continue
+            for node_name, update in chunk.items():
+                self._display_event(node_name, update or {}, final_values)
+        return final_values
+    
+    def _display_event(self, node_name: str, update: Dict[str, Any], values: Dict[str, Any]):
+        """按节点名称输出节点的更新内容"""
+        plan = update.get('current_plan') or values.get('current_plan') or []
+        if node_name == "plan":
+            self._display_plan(plan)
+        elif node_name == "execute":
+            for execution_result in update.get('execution_results', []):
+                self._display_execution_result(execution_result, len(plan))
+        elif node_name == "replan":
+            self._display_replan_info(update, len(plan))
+    
     def _update_state(self, old_state: AgentState, updates: Dict) -> AgentState:
-        """更新状态"""
-        return AgentState(
-            user_input=old_state.user_input,
-            current_plan=updates.get('current_plan', old_state.current_plan),
-            current_step=updates.get('current_step', old_state.current_step),
-            execution_results=updates.get('execution_results', old_state.execution_results),
-            completed=updates.get('completed', old_state.completed),
-            final_answer=updates.get('final_answer', old_state.final_answer)
-        )
+        """更新状态（只取AgentState中定义的字段，新增字段无需修改此处）"""
+        return replace(old_state, **{k: v for k, v in updates.items() if k in AgentState.__dataclass_fields__})
     
-    def _display_plan(self, state: AgentState):
+    def _display_plan(self, plan: List[Dict[str, Any]]):
         """显示计划信息"""
         print("📋 制定的执行计划:")
-        for i, plan_item in enumerate(state.current_plan, 1):
+        for i, plan_item in enumerate(plan, 1):
             desc = plan_item.get('description', '无描述')
             action = plan_item.get('action', '无操作')
             tool = plan_item.get('tool', '无工具')
@@ -179,20 +227,19 @@ class PlanExecuteAgent:
             print(f"     操作: {action}")
             print(f"     工具: {tool}")
     
-    def _display_execution_result(self, state: AgentState):
+    def _display_execution_result(self, execution_result: Dict[str, Any], total_steps: int):
         """显示执行结果"""
-        if state.execution_results:
-            latest_result = state.execution_results[-1]
-            print("⚡ 执行结果:")
-            print(f"  步骤: {latest_result.get('description', '未知步骤')}")
-            print(f"  结果: {latest_result.get('result', '无结果')}")
-            print(f"  进度: {state.current_step}/{len(state.current_plan)}")
+        print("⚡ 执行结果:")
+        print(f"  步骤: {execution_result.get('description', '未知步骤')}")
+        print(f"  结果: {execution_result.get('result', '无结果')}")
+        print(f"  进度: {execution_result.get('step', '?')}/{total_steps}")
     
-    def _display_replan_info(self, state: AgentState):
+    def _display_replan_info(self, update: Dict[str, Any], total_steps: int):
         """显示重新规划信息"""
         print("🔄 重新规划中...")
-        if state.current_plan and state.current_step < len(state.current_plan):
-            remaining = len(state.current_plan) - state.current_step
+        current_step = update.get('current_step')
+        if current_step is not None and current_step < total_steps:
+            remaining = total_steps - current_step
             print(f"  剩余步骤: {remaining}")
 
     def start_conversation(self):
@@ -215,33 +262,62 @@ class PlanExecuteAgent:
         user_input = tk.Entry(input_frame, width=70)
         user_input.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         
+        # 工作线程通过队列把结果交回UI线程（Tk控件只能在主线程中操作）
+        ui_queue = queue.Queue()
+        # 当前回复是否已经开始流式显示
+        streaming = {"started": False}
+        
+        def append_chat(text: str):
+            chat_display.config(state=tk.NORMAL)
+            chat_display.insert(tk.END, text)
+            chat_display.config(state=tk.DISABLED)
+            chat_display.see(tk.END)
+        
+        def worker(message: str):
+            """在后台线程中运行Agent，避免阻塞界面"""
+            try:
+                result = self.run(message, on_token=lambda chunk: ui_queue.put(("token", chunk)))
+                final_answer = result.get('final_answer') or '抱歉，我没有理解您的问题。'
+                ui_queue.put(("ai", final_answer))
+            except Exception as e:
+                ui_queue.put(("error", f"处理请求时出现错误: {str(e)}"))
+        
+        def drain():
+            """定时取出工作线程的结果并更新界面"""
+            while not ui_queue.empty():
+                kind, text = ui_queue.get_nowait()
+                if kind == "token":
+                    # 逐段显示流式生成的AI回复
+                    if not streaming["started"]:
+                        append_chat("AI助手: ")
+                        streaming["started"] = True
+                    append_chat(text)
+                    continue
+                if kind == "ai":
+                    # 显示AI回复（已流式显示过时只需换行）
+                    append_chat("\n\n" if streaming["started"] else f"AI助手: {text}\n\n")
+                else:
+                    if streaming["started"]:
+                        append_chat("\n\n")
+                    append_chat(f"系统: {text}\n\n")
+                    messagebox.showerror("错误", text)
+                # 当前请求处理完毕，允许发送下一条消息
+                streaming["started"] = False
+                send_button.config(state=tk.NORMAL)
+            root.after(50, drain)
+        
         # 创建发送按钮
         def send_message():
             message = user_input.get().strip()
-            if message:
+            # 上一条消息处理中时忽略新的发送
+            if message and send_button['state'] != tk.DISABLED:
                 # 显示用户消息
-                chat_display.config(state=tk.NORMAL)
-                chat_display.insert(tk.END, f"用户: {message}\n\n")
-                chat_display.config(state=tk.DISABLED)
+                append_chat(f"用户: {message}\n\n")
                 user_input.delete(0, tk.END)
                 
                 # 处理用户输入
-                try:
-                    result = self.run(message)
-                    final_answer = result.get('final_answer', '抱歉，我没有理解您的问题。')
-                    
-                    # 显示AI回复
-                    chat_display.config(state=tk.NORMAL)
-                    chat_display.insert(tk.END, f"AI助手: {final_answer}\n\n")
-                    chat_display.config(state=tk.DISABLED)
-                    chat_display.see(tk.END)
-                
-                except Exception as e:
-                    error_msg = f"处理请求时出现错误: {str(e)}"
-                    chat_display.config(state=tk.NORMAL)
-                    chat_display.insert(tk.END, f"系统: {error_msg}\n\n")
-                    chat_display.config(state=tk.DISABLED)
-                    messagebox.showerror("错误", error_msg)
+                send_button.config(state=tk.DISABLED)
+                threading.Thread(target=worker, args=(message,), daemon=True).start()
         
         send_button = tk.Button(input_frame, text="发送", command=send_message)
         send_button.pack(side=tk.RIGHT, padx=5)
@@ -254,7 +330,8 @@ class PlanExecuteAgent:
         chat_display.insert(tk.END, "欢迎使用FinAgent对话系统！\n请输入您的问题开始对话。\n\n")
         chat_display.config(state=tk.DISABLED)
         
-        # 启动GUI主循环
+        # 启动结果轮询和GUI主循环
+        root.after(50, drain)
         root.mainloop()
 
 
@@ -263,6 +340,8 @@ if __name__ == "__main__":
     # 创建并配置MCP服务器和客户端
     mcp_server = create_local_mcp_server()
     setup_local_mcp_client(mcp_server)
+    # 后台预热股票身份索引（下载A股、港股、美股代码列表）
+    warm_identity_index()
     []
     agent = PlanExecuteAgent()
     
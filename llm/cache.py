@@ -0,0 +1,277 @@
+"""
+创建日期：2026年10月15日
+介绍：LLM响应缓存 - SHA-256精确匹配 + 可选的向量语义匹配，使用SQLite持久化
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from utils.json_utils import dumps
+
+# 尝试导入numpy和sentence-transformers，用于语义缓存（可选）
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+    has_embedding_model = True
+except ImportError:
+    has_embedding_model = False
+
+
+CACHE_DB_PATH = os.environ.get("LLM_CACHE_PATH", "llm_cache.db")
+SEMANTIC_MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+SEMANTIC_THRESHOLD = 0.95
+MEMORY_CACHE_SIZE = 1024  # 进程内缓存的最大条目数，超出时淘汰最久未使用的条目
+
+
+def cache_enabled() -> bool:
+    """是否启用LLM缓存（环境变量 LLM_CACHE=1）"""
+    return os.environ.get("LLM_CACHE") == "1"
+
+
+def semantic_cache_enabled() -> bool:
+    """是否启用语义缓存（环境变量 LLM_CACHE_SEMANTIC=1），默认只做精确匹配"""
+    return os.environ.get("LLM_CACHE_SEMANTIC") == "1"
+
+
+def normalize_messages(messages: Union[str, List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    """
+    规范化消息：字符串提示词转换为单条user消息，并去除内容首尾空白
+
+    Args:
+        messages: 字符串提示词或消息列表
+
+    Returns:
+        规范化后的消息列表
+    """
+    if isinstance(messages, str):
+        messages = [{"role": "user", "content": messages}]
+    return [
+        {"role": msg.get("role", "user"), "content": str(msg.get("content", "")).strip()}
+        for msg in messages
+    ]
+
+
+def split_messages(messages: Union[str, List[Dict[str, str]]]) -> Tuple[str, str]:
+    """
+    拆分消息中的静态前缀（system消息）和动态内容（其余消息）
+
+    Args:
+        messages: 字符串提示词或消息列表
+
+    Returns:
+        (静态前缀文本, 动态内容文本)
+    """
+    normalized = normalize_messages(messages)
+    prefix = "\n".join(msg["content"] for msg in normalized if msg["role"] == "system")
+    dynamic = "\n".join(msg["content"] for msg in normalized if msg["role"] != "system")
+    return prefix, dynamic
+
+
+def prefix_hash(messages: Union[str, List[Dict[str, str]]]) -> str:
+    """静态前缀的SHA-256，语义匹配只在前缀相同的缓存条目之间进行"""
+    return hashlib.sha256(split_messages(messages)[0].encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """LLM响应缓存（进程内字典 + SQLite持久化）"""
+
+    def __init__(self, db_path: str = CACHE_DB_PATH, semantic: Optional[bool] = None):
+        """
+        初始化LLM缓存
+
+        Args:
+            db_path: SQLite数据库文件路径
+            semantic: 是否启用语义匹配，默认读取环境变量 LLM_CACHE_SEMANTIC
+        """
+        if semantic is None:
+            semantic = semantic_cache_enabled()
+        self.db_path = db_path
+        self.semantic = semantic and has_embedding_model
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, str]" = OrderedDict()  # 进程内LRU缓存，key -> response
+        # 语义匹配的内存索引：(模型, 前缀哈希) -> [向量列表, 响应列表, 堆叠后的矩阵（有新增时置None）]，首次查询时从SQLite加载
+        self._semantic_index: Dict[Tuple[str, str], list] = {}
+        self._embedding_model = None
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, embedding BLOB, prefix_hash TEXT)"
+        )
+        # 兼容旧版本创建的缓存库（没有prefix_hash列）
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(llm_cache)")}
+        if "prefix_hash" not in columns:
+            self._conn.execute("ALTER TABLE llm_cache ADD COLUMN prefix_hash TEXT")
+        self._conn.commit()
+
+    @staticmethod
+    def cache_key(model: str, messages: Union[str, List[Dict[str, str]]]) -> str:
+        """
+        计算缓存键：sha256(model + 静态前缀哈希 + 规范化消息)
+
+        Args:
+            model: 模型名称
+            messages: 字符串提示词或消息列表
+
+        Returns:
+            十六进制缓存键
+        """
+        payload = dumps(
+            {"model": model, "prefix": prefix_hash(messages), "messages": normalize_messages(messages)},
+            sort_keys=True
+        )
+        return hashlib.sha256(payload).hexdigest()
+
+    def get(self, key: str, model: str = None, messages: Union[str, List[Dict[str, str]]] = None) -> Optional[str]:
+        """
+        查询缓存：先精确匹配，未命中且启用语义缓存时再做向量相似度匹配
+
+        Args:
+            key: 缓存键
+            model: 模型名称（语义匹配时使用）
+            messages: 原始消息（语义匹配时使用）
+
+        Returns:
+            命中的响应文本，未命中返回None
+        """
+        with self._lock:
+            response = self._memory.get(key)
+            if response is None:
+                row = self._conn.execute(
+                    "SELECT response FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    response = row[0]
+                    self._remember(key, response)
+            else:
+                self._memory.move_to_end(key)
+
+        if response is None and self.semantic and messages is not None:
+            response = self._semantic_get(model, messages)
+
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    def set(self, key: str, response: str, model: str = None, messages: Union[str, List[Dict[str, str]]] = None):
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            response: LLM响应文本
+            model: 模型名称
+            messages: 原始消息（启用语义缓存时用于生成向量）
+        """
+        embedding = None
+        group = None
+        if self.semantic and messages is not None:
+            embedding = self._embed(messages)
+            group = (model, prefix_hash(messages))
+
+        with self._lock:
+            self._remember(key, response)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, response, embedding, prefix_hash) VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, None if embedding is None else embedding.tobytes(), group and group[1])
+            )
+            self._conn.commit()
+            # 已加载的内存索引同步追加，未加载的在首次查询时从SQLite读取
+            entry = self._semantic_index.get(group) if group else None
+            if entry is not None:
+                entry[0].append(embedding)
+                entry[1].append(response)
+                entry[2] = None
+
+    def clear(self):
+        """清空缓存（进程内缓存和SQLite中的记录），用于提示词不再幂等或需要强制重新生成时"""
+        with self._lock:
+            self._memory.clear()
+            self._semantic_index.clear()
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存命中统计
+
+        Returns:
+            包含 hits、misses、hit_rate 的字典
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def _remember(self, key: str, response: str):
+        """写入进程内LRU缓存（调用方需持有锁），超出容量时淘汰最久未使用的条目"""
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > MEMORY_CACHE_SIZE:
+            self._memory.popitem(last=False)
+
+    def _embed(self, messages: Union[str, List[Dict[str, str]]]):
+        """
+        生成动态内容的归一化向量
+        只编码非system消息：静态前缀长达数KB，而嵌入模型只读取前128个token，带上前缀时所有提示词的向量几乎相同
+        """
+        if self._embedding_model is None:
+            self._embedding_model = SentenceTransformer(SEMANTIC_MODEL_NAME)
+        text = split_messages(messages)[1]
+        return self._embedding_model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+    def _semantic_get(self, model: str, messages: Union[str, List[Dict[str, str]]]) -> Optional[str]:
+        """语义匹配：在同一模型、同一静态前缀的缓存中查找余弦相似度超过阈值的响应"""
+        group = (model, prefix_hash(messages))
+        with self._lock:
+            entry = self._semantic_index.get(group)
+            if entry is None:
+                rows = self._conn.execute(
+                    "SELECT response, embedding FROM llm_cache WHERE model = ? AND prefix_hash = ? AND embedding IS NOT NULL",
+                    group
+                ).fetchall()
+                entry = [[np.frombuffer(row[1], dtype=np.float32) for row in rows], [row[0] for row in rows], None]
+                self._semantic_index[group] = entry
+            if not entry[1]:
+                return None
+            if entry[2] is None:
+                entry[2] = np.stack(entry[0])
+            matrix, responses = entry[2], entry[1]
+
+        query = self._embed(messages)
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        if scores[best] > SEMANTIC_THRESHOLD:
+            return responses[best]
+        return None
+
+
+# 全局缓存实例（延迟创建）
+_llm_cache = None
+
+
+def get_llm_cache() -> LLMCache:
+    """获取全局LLM缓存实例"""
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMCache()
+    return _llm_cache
+
+
+def clear_llm_cache():
+    """清空全局LLM缓存（未创建缓存实例时不做任何操作）"""
+    if _llm_cache is not None:
+        _llm_cache.clear()
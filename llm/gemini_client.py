@@ -1,14 +1,14 @@
 # llm/gemini_client.py
 import google.genai as genai
-from typing import List, Dict, Any, Union
+from typing import AsyncIterator, Iterator, List, Dict, Any, Optional, Tuple, Union
 from utils.config import load_config
+from llm.cache import cache_enabled, get_llm_cache
 import os
+from functools import lru_cache
 
-def gemini_chat(messages: Union[str, List[Dict[str, str]]]) -> str:
-    """
-    调用 Gemini 模型生成回复。
-    参数 messages 可以是字符串提示词，也可以是消息列表 [{"role": "user", "content": "..."}]。
-    """
+
+def _resolve_config() -> Tuple[Optional[str], str]:
+    """读取 Gemini 的 API Key 与模型名称"""
     config = load_config()
     gemini_config = config.get("gemini", {})
     api_key = gemini_config.get("api_key")
@@ -17,38 +17,176 @@ def gemini_chat(messages: Union[str, List[Dict[str, str]]]) -> str:
     # 尝试从环境变量获取 API Key（如果配置文件中未设置或为默认值）
     if not api_key or api_key == "YOUR_GEMINI_API_KEY":
         api_key = os.environ.get("GEMINI_API_KEY")
-    
+    return api_key, model_name
+
+
+@lru_cache(maxsize=4)
+def _get_client(api_key: str) -> genai.Client:
+    """按 API Key 缓存 Gemini 客户端，避免每次调用都重新创建"""
+    return genai.Client(api_key=api_key)
+
+
+def _build_prompt(messages: Union[str, List[Dict[str, str]]]) -> Optional[str]:
+    """将消息转换为文本 Prompt，格式不正确时返回 None"""
+    if isinstance(messages, str):
+        return messages
+    if isinstance(messages, list):
+        # 静态前缀（system消息）+ 动态内容：原样拼接，前缀在最前面以命中Gemini的隐式前缀缓存
+        if len(messages) == 2 and messages[0].get("role") == "system" and messages[1].get("role") == "user":
+            return messages[0].get("content", "") + messages[1].get("content", "")
+        # 简单地将消息列表转换为文本 Prompt
+        # 注意：Gemini 也有 start_chat 模式，但为了兼容性暂且拼接
+        prompt = ""
+        for msg in messages:
+            role = msg.get("role", "user")
+            content = msg.get("content", "")
+            # 简单的角色标记
+            if role == "user":
+                prompt += f"User: {content}\n"
+            elif role == "assistant":
+                prompt += f"Model: {content}\n"
+            else:
+                prompt += f"{role}: {content}\n"
+        return prompt
+    return None
+
+
+def gemini_chat(messages: Union[str, List[Dict[str, str]]], use_cache: bool = True) -> str:
+    """
+    调用 Gemini 模型生成回复。
+    参数 messages 可以是字符串提示词，也可以是消息列表 [{"role": "user", "content": "..."}]。
+    """
+    api_key, model_name = _resolve_config()
     if not api_key:
         return "错误: 未配置 Gemini API Key。请在 config.yml 中设置 gemini.api_key 或设置环境变量 GEMINI_API_KEY。"
         
+    # 命中缓存时直接返回，跳过API调用
+    cache = get_llm_cache() if use_cache and cache_enabled() else None
+    if cache:
+        cache_key = cache.cache_key(model_name, messages)
+        cached = cache.get(cache_key, model_name, messages)
+        if cached is not None:
+            return cached
+
     try:
-        client = genai.Client(api_key=api_key)
+        client = _get_client(api_key)
         
         # 构造 Prompt
-        if isinstance(messages, str):
-            prompt = messages
-        elif isinstance(messages, list):
-            # 简单地将消息列表转换为文本 Prompt
-            # 注意：Gemini 也有 start_chat 模式，但为了兼容性暂且拼接
-            prompt = ""
-            for msg in messages:
-                role = msg.get("role", "user")
-                content = msg.get("content", "")
-                # 简单的角色标记
-                if role == "user":
-                    prompt += f"User: {content}\n"
-                elif role == "assistant":
-                    prompt += f"Model: {content}\n"
-                else:
-                    prompt += f"{role}: {content}\n"
-        else:
+        prompt = _build_prompt(messages)
+        if prompt is None:
             return "错误: 消息格式不正确"
             
         response = client.models.generate_content(
             model=model_name,
             contents=prompt
         )
+        if cache and response.text:
+            cache.set(cache_key, response.text, model_name, messages)
         return response.text
         
     except Exception as e:
         return f"Gemini API 调用失败: {str(e)}"
+
+
+async def gemini_chat_async(messages: Union[str, List[Dict[str, str]]], use_cache: bool = True) -> str:
+    """gemini_chat 的异步版本（使用 client.aio），多个调用可在同一事件循环中并发"""
+    api_key, model_name = _resolve_config()
+    if not api_key:
+        return "错误: 未配置 Gemini API Key。请在 config.yml 中设置 gemini.api_key 或设置环境变量 GEMINI_API_KEY。"
+
+    cache = get_llm_cache() if use_cache and cache_enabled() else None
+    if cache:
+        cache_key = cache.cache_key(model_name, messages)
+        cached = cache.get(cache_key, model_name, messages)
+        if cached is not None:
+            return cached
+
+    try:
+        client = _get_client(api_key)
+
+        prompt = _build_prompt(messages)
+        if prompt is None:
+            return "错误: 消息格式不正确"
+
+        response = await client.aio.models.generate_content(
+            model=model_name,
+            contents=prompt
+        )
+        if cache and response.text:
+            cache.set(cache_key, response.text, model_name, messages)
+        return response.text
+
+    except Exception as e:
+        return f"Gemini API 调用失败: {str(e)}"
+
+
+def gemini_chat_stream(messages: Union[str, List[Dict[str, str]]], use_cache: bool = True) -> Iterator[str]:
+    """流式调用 Gemini，逐段返回生成的文本"""
+    api_key, model_name = _resolve_config()
+    if not api_key:
+        yield "错误: 未配置 Gemini API Key。请在 config.yml 中设置 gemini.api_key 或设置环境变量 GEMINI_API_KEY。"
+        return
+
+    cache = get_llm_cache() if use_cache and cache_enabled() else None
+    if cache:
+        cache_key = cache.cache_key(model_name, messages)
+        cached = cache.get(cache_key, model_name, messages)
+        if cached is not None:
+            yield cached
+            return
+
+    prompt = _build_prompt(messages)
+    if prompt is None:
+        yield "错误: 消息格式不正确"
+        return
+
+    chunks = []
+    try:
+        for chunk in _get_client(api_key).models.generate_content_stream(
+            model=model_name,
+            contents=prompt
+        ):
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+    except Exception as e:
+        yield f"Gemini API 调用失败: {str(e)}"
+        return
+    if cache and chunks:
+        cache.set(cache_key, "".join(chunks), model_name, messages)
+
+
+async def gemini_chat_stream_async(messages: Union[str, List[Dict[str, str]]], use_cache: bool = True) -> AsyncIterator[str]:
+    """gemini_chat_stream 的异步版本"""
+    api_key, model_name = _resolve_config()
+    if not api_key:
+        yield "错误: 未配置 Gemini API Key。请在 config.yml 中设置 gemini.api_key 或设置环境变量 GEMINI_API_KEY。"
+        return
+
+    cache = get_llm_cache() if use_cache and cache_enabled() else None
+    if cache:
+        cache_key = cache.cache_key(model_name, messages)
+        cached = cache.get(cache_key, model_name, messages)
+        if cached is not None:
+            yield cached
+            return
+
+    prompt = _build_prompt(messages)
+    if prompt is None:
+        yield "错误: 消息格式不正确"
+        return
+
+    chunks = []
+    try:
+        async for chunk in await _get_client(api_key).aio.models.generate_content_stream(
+            model=model_name,
+            contents=prompt
+        ):
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+    except Exception as e:
+        yield f"Gemini API 调用失败: {str(e)}"
+        return
+    if cache and chunks:
+        cache.set(cache_key, "".join(chunks), model_name, messages)
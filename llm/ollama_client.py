@@ -3,23 +3,180 @@
 介绍： Ollama下载的本地模型
 """
 
+import asyncio
+import weakref
+from typing import AsyncIterator, Iterator
+
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 
 from utils.config import load_config
+from utils.json_utils import dumps, loads
+from llm.cache import cache_enabled, get_llm_cache
+
+# 尝试导入h2（可选，httpx的HTTP/2支持依赖它），未安装时异步客户端使用HTTP/1.1
+try:
+    import h2
+    has_h2 = True
+except ImportError:
+    has_h2 = False
+
+
+# 同步调用复用同一个Session，保持keep-alive连接
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# 每个事件循环复用一个AsyncClient（keep-alive连接池不能跨事件循环共享），事件循环结束前由 close_async_client 关闭
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
 
 
+def _get_async_client() -> httpx.AsyncClient:
+    """获取当前事件循环对应的httpx异步客户端（超时时间由每个请求单独指定）"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        # Ollama通常是明文HTTP，HTTP/2只在服务端支持（如经过HTTPS反向代理）时协商生效
+        client = httpx.AsyncClient(
+            http2=has_h2,
+            limits=httpx.Limits(max_keepalive_connections=20)
+        )
+        _async_clients[loop] = client
+    return client
 
 
-def ollama_chat(messages: list[dict], stream: bool = False, timeout: int = 600):
+async def close_async_client():
+    """关闭当前事件循环的httpx异步客户端，释放keep-alive连接（在事件循环结束前调用）"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def ollama_chat(messages: list[dict], stream: bool = False, timeout: int = 600, use_cache: bool = True):
     config = load_config()
     ollama_base_url = config["ollama"]["base_url"]
     model_name = config["ollama"]["model"]
+
+    # 命中缓存时直接返回，跳过HTTP请求
+    cache = get_llm_cache() if use_cache and cache_enabled() else None
+    if cache:
+        cache_key = cache.cache_key(model_name, messages)
+        cached = cache.get(cache_key, model_name, messages)
+        if cached is not None:
+            return cached
+
     payload = {
         "model": model_name,
         "messages": messages,
         "stream": stream,
     }
-    r = requests.post(ollama_base_url, json=payload, timeout=timeout)
+    r = _session.post(ollama_base_url, data=dumps(payload), headers=_JSON_HEADERS, timeout=timeout)
+    r.raise_for_status()
+    data = loads(r.content)
+    content = data["message"]["content"]
+    if cache:
+        cache.set(cache_key, content, model_name, messages)
+    return content
+
+
+async def ollama_chat_async(messages: list[dict], timeout: int = 600, use_cache: bool = True):
+    """ollama_chat的异步版本，多个调用可在同一事件循环中并发"""
+    config = load_config()
+    ollama_base_url = config["ollama"]["base_url"]
+    model_name = config["ollama"]["model"]
+
+    cache = get_llm_cache() if use_cache and cache_enabled() else None
+    if cache:
+        cache_key = cache.cache_key(model_name, messages)
+        cached = cache.get(cache_key, model_name, messages)
+        if cached is not None:
+            return cached
+
+    payload = {
+        "model": model_name,
+        "messages": messages,
+        "stream": False,
+    }
+    r = await _get_async_client().post(ollama_base_url, content=dumps(payload), headers=_JSON_HEADERS, timeout=timeout)
     r.raise_for_status()
-    data = r.json()
-    return data["message"]["content"]
+    data = loads(r.content)
+    content = data["message"]["content"]
+    if cache:
+        cache.set(cache_key, content, model_name, messages)
+    return content
+
+
+def ollama_chat_stream(messages: list[dict], timeout: int = 600, use_cache: bool = True) -> Iterator[str]:
+    """流式调用ollama，逐段返回生成的内容（首个token到达即可开始处理）"""
+    config = load_config()
+    ollama_base_url = config["ollama"]["base_url"]
+    model_name = config["ollama"]["model"]
+
+    cache = get_llm_cache() if use_cache and cache_enabled() else None
+    if cache:
+        cache_key = cache.cache_key(model_name, messages)
+        cached = cache.get(cache_key, model_name, messages)
+        if cached is not None:
+            yield cached
+            return
+
+    payload = {
+        "model": model_name,
+        "messages": messages,
+        "stream": True,
+    }
+    chunks = []
+    with _session.post(ollama_base_url, data=dumps(payload), headers=_JSON_HEADERS, timeout=timeout, stream=True) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if not line:
+                continue
+            data = loads(line)
+            content = data.get("message", {}).get("content", "")
+            if content:
+                chunks.append(content)
+                yield content
+            if data.get("done"):
+                break
+    if cache:
+        cache.set(cache_key, "".join(chunks), model_name, messages)
+
+
+async def ollama_chat_stream_async(messages: list[dict], timeout: int = 600, use_cache: bool = True) -> AsyncIterator[str]:
+    """ollama_chat_stream的异步版本"""
+    config = load_config()
+    ollama_base_url = config["ollama"]["base_url"]
+    model_name = config["ollama"]["model"]
+
+    cache = get_llm_cache() if use_cache and cache_enabled() else None
+    if cache:
+        cache_key = cache.cache_key(model_name, messages)
+        cached = cache.get(cache_key, model_name, messages)
+        if cached is not None:
+            yield cached
+            return
+
+    payload = {
+        "model": model_name,
+        "messages": messages,
+        "stream": True,
+    }
+    chunks = []
+    async with _get_async_client().stream("POST", ollama_base_url, content=dumps(payload), headers=_JSON_HEADERS, timeout=timeout) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line:
+                continue
+            data = loads(line)
+            content = data.get("message", {}).get("content", "")
+            if content:
+                chunks.append(content)
+                yield content
+            if data.get("done"):
+                break
+    if cache:
+        cache.set(cache_key, "".join(chunks), model_name, messages)
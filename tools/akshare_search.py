@@ -3,14 +3,198 @@
 介绍：股票数据搜索工具，基于akshare获取实时股票信息，支持智能识别市场和代码
 """
 
-import akshare as ak
-import pandas as pd
-from typing import Dict, List, Union, Optional
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List, Union, Optional
 import sys
 import os
+import time
+import shelve
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# akshare/pandas 导入耗时较长，推迟到实际查询时再导入
+if TYPE_CHECKING:
+    import pandas as pd
+
+# 多只股票并发查询的最大线程数
+MAX_QUERY_WORKERS = 16
+
+# 全市场行情快照缓存：市场 -> (获取时间, DataFrame)
+# 实时行情接口每次都会下载整个市场的数据，短时间内的多次查询复用同一份快照
+SPOT_CACHE_TTL = 10  # 秒
+_SPOT_CACHE: Dict[str, tuple] = {}
+_SPOT_LOCKS: Dict[str, threading.Lock] = {}
+
+# 本地股票身份索引（代码/简称 -> Market|Ticker|Name），启动时由 warm_identity_index 在后台构建
+_IDENTITY_INDEX: Dict[str, str] = {}
+# 已成功加载到索引中的市场；加载失败的市场记录失败时间，冷却期过后的查询再重试
+_IDENTITY_MARKETS = (("A", "A股"), ("HK", "港股"), ("US", "美股"))
+_IDENTITY_MARKETS_LOADED: set = set()
+_IDENTITY_MARKET_FAILED_AT: Dict[str, float] = {}
+IDENTITY_RETRY_COOLDOWN = 300  # 秒
+_IDENTITY_INDEX_LOCK = threading.Lock()
+
+# 股票身份识别结果的持久化缓存（shelve文件）
+IDENTITY_CACHE_PATH = os.environ.get("STOCK_ID_CACHE_PATH", ".stock_id_cache")
+_IDENTITY_CACHE_LOCK = threading.Lock()
+
+# 代码后缀 -> 市场
+_SUFFIX_MARKETS = {".US": "US", ".HK": "HK"}
+
+
+def _get_spot(market: str, fetch, ttl: float = SPOT_CACHE_TTL, prepare=None):
+    """
+    获取全市场行情快照（以'代码'为索引），在ttl秒内复用缓存
+    
+    Args:
+        market: 市场标识（a/hk/us）
+        fetch: 获取快照的akshare接口
+        ttl: 缓存有效期（秒）
+        prepare: 可选，快照拉取后执行一次的预处理函数，缓存并返回其结果（用于构建辅助索引）
+    """
+    hit = _SPOT_CACHE.get(market)
+    if hit and time.monotonic() - hit[0] < ttl:
+        return hit[1]
+    # 同一市场同时只有一个线程拉取快照，其余线程等待后直接使用新快照
+    with _SPOT_LOCKS.setdefault(market, threading.Lock()):
+        hit = _SPOT_CACHE.get(market)
+        if hit and time.monotonic() - hit[0] < ttl:
+            return hit[1]
+        # 按代码建立索引，单只股票的查询变为哈希查找而不是整表比较
+        df = fetch().set_index('代码', drop=False)
+        value = prepare(df) if prepare else df
+        _SPOT_CACHE[market] = (time.monotonic(), value)
+        return value
+
+
+def _index_us_spot(df: pd.DataFrame) -> tuple:
+    """
+    为美股快照建立 ticker -> 完整代码 的映射（如 NVDA -> 105.NVDA）
+    
+    Returns:
+        (快照DataFrame, 映射字典)，同一ticker出现多次时保留第一个
+    """
+    # 用pandas向量化字符串操作一次性截取后缀，代替逐行的Python循环
+    codes = df['代码'].astype(str)
+    suffixes = codes.str.rsplit('.', n=1).str[-1]
+    first = ~suffixes.duplicated()
+    suffix_map = dict(zip(suffixes[first].tolist(), codes[first].tolist()))
+    return df, suffix_map
+
+
+def _load_identity_market(market: str) -> List[tuple]:
+    """
+    获取一个市场的 (ticker, 名称) 列表
+    
+    Args:
+        market: 市场代码（A/HK/US）
+    """
+    import akshare as ak
+
+    if market == "A":
+        df = ak.stock_info_a_code_name()
+        return [(str(code), str(name)) for code, name in zip(df['code'], df['name'])]
+    if market == "HK":
+        df = _get_spot('hk', ak.stock_hk_spot_em)
+        return [(str(code), str(name)) for code, name in zip(df['代码'], df['名称'])]
+    df, _ = _get_spot('us', ak.stock_us_spot_em, prepare=_index_us_spot)
+    return [(str(code).rsplit('.', 1)[-1], str(name)) for code, name in zip(df['代码'], df['名称'])]
+
+
+def _pending_identity_markets() -> List[tuple]:
+    """尚未加载且不在失败冷却期内的市场"""
+    now = time.monotonic()
+    return [
+        (market, label) for market, label in _IDENTITY_MARKETS
+        if market not in _IDENTITY_MARKETS_LOADED
+        and now - _IDENTITY_MARKET_FAILED_AT.get(market, float("-inf")) >= IDENTITY_RETRY_COOLDOWN
+    ]
+
+
+def _ensure_identity_index(blocking: bool = True):
+    """
+    将尚未成功加载的市场加入本地股票身份索引
+    键为大写ticker或中文简称，值为 Market|Ticker|Name；同名时按A股、港股、美股的顺序保留第一个
+    某个市场加载失败（如网络波动、接口限流）时记录失败时间，IDENTITY_RETRY_COOLDOWN 秒内不再重试
+    
+    Args:
+        blocking: 为False时，若其他线程（如启动时的预热）正在加载则直接返回，不等待
+    """
+    if not _IDENTITY_INDEX_LOCK.acquire(blocking=blocking):
+        return
+    try:
+        for market, label in _pending_identity_markets():
+            try:
+                rows = _load_identity_market(market)
+            except Exception as e:
+                _IDENTITY_MARKET_FAILED_AT[market] = time.monotonic()
+                print(f"加载{label}代码列表失败（{IDENTITY_RETRY_COOLDOWN}秒后重试）: {e}")
+                continue
+            for ticker, name in rows:
+                identity = f"{market}|{ticker}|{name}"
+                for key in (ticker.upper(), name):
+                    if key:
+                        _IDENTITY_INDEX.setdefault(key, identity)
+            _IDENTITY_MARKETS_LOADED.add(market)
+            _IDENTITY_MARKET_FAILED_AT.pop(market, None)
+    finally:
+        _IDENTITY_INDEX_LOCK.release()
+
+
+def warm_identity_index():
+    """在后台线程中预先构建本地股票身份索引（启动时调用），避免首次查询时在工具调用中同步下载各市场列表"""
+    threading.Thread(target=_ensure_identity_index, name="identity-index-warmup", daemon=True).start()
+
+
+def _lookup_local_identity(query: str) -> Optional[str]:
+    """
+    在本地索引中精确匹配股票代码或简称
+    有可重试的市场时尝试加载；预热或其他加载仍在进行时不等待，直接查已加载的部分（未命中时由调用方回退到LLM识别）
+    
+    Returns:
+        Market|Ticker|Name 格式的身份字符串，未命中返回None
+    """
+    if _pending_identity_markets():
+        _ensure_identity_index(blocking=False)
+    return _IDENTITY_INDEX.get(query) or _IDENTITY_INDEX.get(query.upper())
 
 
 def _resolve_stock_identity(query: str) -> str:
+    """
+    识别输入的股票身份（带缓存）
+    返回格式：Market|Ticker|Name
+    示例：US|NVDA|英伟达
+    """
+    try:
+        return _cached_stock_identity(query)
+    except LookupError:
+        return "UNKNOWN|NONE|NONE"
+
+
+@lru_cache(maxsize=4096)
+def _cached_stock_identity(query: str) -> str:
+    """
+    进程内缓存 + 磁盘持久化缓存的股票身份识别，只缓存识别成功的结果
+    识别失败时抛出LookupError（不会被lru_cache缓存，下次仍会重新识别）
+    """
+    with _IDENTITY_CACHE_LOCK:
+        with shelve.open(IDENTITY_CACHE_PATH) as db:
+            if query in db:
+                return db[query]
+
+    identity = _resolve_stock_identity_llm(query)
+    if identity.split('|', 1)[0] not in ("A", "US", "HK"):
+        raise LookupError(query)
+
+    with _IDENTITY_CACHE_LOCK:
+        with shelve.open(IDENTITY_CACHE_PATH) as db:
+            db[query] = identity
+    return identity
+
+
+def _resolve_stock_identity_llm(query: str) -> str:
     """
     使用LLM识别输入的股票身份
     返回格式：Market|Ticker|Name
@@ -81,19 +265,24 @@ def akshare_search(stock_code: str, data_type: str = "realtime", start_date: str
 
         # 支持多只股票查询（逗号分隔）
         if "," in stock_code or "，" in stock_code:
+            import pandas as pd
+
             codes = [c.strip() for c in stock_code.replace("，", ",").split(",") if c.strip()]
             multi_results = {}
-            for code in codes:
-                try:
-                    # 递归调用单只股票查询
-                    res = akshare_search(code, data_type, start_date, end_date)
-                    if isinstance(res, pd.DataFrame):
-                        # DataFrame 转字典以便合并
-                        multi_results[code] = res.to_dict(orient="records")
-                    else:
-                        multi_results[code] = res
-                except Exception as e:
-                    multi_results[code] = f"查询失败: {str(e)}"
+            # 各只股票的查询都是网络I/O，在线程池中并发执行
+            with ThreadPoolExecutor(max_workers=min(MAX_QUERY_WORKERS, len(codes))) as executor:
+                # 递归调用单只股票查询
+                futures = {code: executor.submit(akshare_search, code, data_type, start_date, end_date) for code in codes}
+                for code, future in futures.items():
+                    try:
+                        res = future.result()
+                        if isinstance(res, pd.DataFrame):
+                            # DataFrame 转字典以便合并
+                            multi_results[code] = res.to_dict(orient="records")
+                        else:
+                            multi_results[code] = res
+                    except Exception as e:
+                        multi_results[code] = f"查询失败: {str(e)}"
             return multi_results
 
         market = None
@@ -101,26 +290,27 @@ def akshare_search(stock_code: str, data_type: str = "realtime", start_date: str
         name = None
         
         # 1. Input Pre-check
+        upper_code = stock_code.upper()
+        suffix_market = _SUFFIX_MARKETS.get(upper_code[-3:])
         # 6位纯数字 -> A股
         if stock_code.isdigit() and len(stock_code) == 6:
             market = "A"
             ticker = stock_code
             name = stock_code
-        # .US 后缀 -> 美股
-        elif stock_code.upper().endswith(".US"):
-            market = "US"
-            ticker = stock_code.upper().replace(".US", "")
-            name = ticker
-        # .HK 后缀 -> 港股
-        elif stock_code.upper().endswith(".HK"):
-            market = "HK"
-            ticker = stock_code.upper().replace(".HK", "")
+        # .US 后缀 -> 美股，.HK 后缀 -> 港股
+        elif suffix_market:
+            market = suffix_market
+            ticker = upper_code[:-3]
             name = ticker
-        # 包含中文或纯字母 -> LLM Routing
+        # 包含中文或纯字母 -> 本地代码/名称索引，未命中时 LLM Routing
         else:
-            print(f"调用LLM识别股票身份: {stock_code}")
-            identity = _resolve_stock_identity(stock_code)
-            print(f"LLM识别结果: {identity}")
+            identity = _lookup_local_identity(stock_code)
+            if identity:
+                print(f"本地索引识别结果: {identity}")
+            else:
+                print(f"调用LLM识别股票身份: {stock_code}")
+                identity = _resolve_stock_identity(stock_code)
+                print(f"LLM识别结果: {identity}")
             
             parts = identity.split('|')
             if len(parts) >= 2 and parts[0] in ["A", "US", "HK"]:
@@ -147,17 +337,19 @@ def akshare_search(stock_code: str, data_type: str = "realtime", start_date: str
 
 def _handle_a_share(ticker: str, data_type: str, start_date: str = None, end_date: str = None):
     """处理A股查询"""
+    import akshare as ak
+
     # 简单的A股代码标准化
     # AKShare 接口通常接受纯数字代码，或者 sh/sz 前缀
     # stock_zh_a_spot_em 返回的代码是纯数字
     
     if data_type == "realtime":
-        df = ak.stock_zh_a_spot_em()
+        df = _get_spot('a', ak.stock_zh_a_spot_em)
         # 精确匹配代码
-        result = df[df['代码'] == ticker]
-        if result.empty:
-             raise ValueError(f"未找到A股代码: {ticker}")
-        return result
+        try:
+            return df.loc[[ticker]]
+        except KeyError:
+            raise ValueError(f"未找到A股代码: {ticker}")
     elif data_type == "history":
         if start_date and end_date:
             return ak.stock_zh_a_hist(symbol=ticker, period="daily", start_date=start_date, end_date=end_date, adjust="qfq")
@@ -165,22 +357,25 @@ def _handle_a_share(ticker: str, data_type: str, start_date: str = None, end_dat
             return ak.stock_zh_a_hist(symbol=ticker, period="daily", adjust="qfq")
     elif data_type == "info":
         df = ak.stock_individual_info_em(symbol=ticker)
-        return df.set_index('item')['value'].to_dict()
+        # 直接按列配对构建字典，不再额外创建以item为索引的Series
+        return dict(zip(df['item'].tolist(), df['value'].tolist()))
     else:
         raise ValueError(f"不支持的数据类型: {data_type}")
 
 def _handle_hk_share(ticker: str, data_type: str, start_date: str = None, end_date: str = None):
     """处理港股查询"""
+    import akshare as ak
+
     # 确保5位代码
     if ticker.isdigit() and len(ticker) < 5:
         ticker = ticker.zfill(5)
         
     if data_type == "realtime":
-        df = ak.stock_hk_spot_em()
-        result = df[df['代码'] == ticker]
-        if result.empty:
+        df = _get_spot('hk', ak.stock_hk_spot_em)
+        try:
+            return df.loc[[ticker]]
+        except KeyError:
             raise ValueError(f"未找到港股代码: {ticker}")
-        return result
     elif data_type == "history":
         if start_date and end_date:
             return ak.stock_hk_hist(symbol=ticker, period="daily", start_date=start_date, end_date=end_date, adjust="qfq")
@@ -191,38 +386,43 @@ def _handle_hk_share(ticker: str, data_type: str, start_date: str = None, end_da
     else:
         raise ValueError(f"不支持的数据类型: {data_type}")
 
+@lru_cache(maxsize=8192)
+def _us_full_symbol(ticker: str) -> str:
+    """
+    将美股ticker解析为AKShare使用的完整代码（如 NVDA -> 105.NVDA）
+    解析结果按ticker缓存，重复的历史查询无需再下载实时快照；未找到时抛出ValueError（异常不会被缓存）
+    """
+    import akshare as ak
+
+    df, suffix_map = _get_spot('us', ak.stock_us_spot_em, prepare=_index_us_spot)
+    # 匹配 symbol 后缀 (例如 105.NVDA -> NVDA)，找不到时尝试直接匹配完整代码
+    if ticker in suffix_map:
+        return suffix_map[ticker]
+    if ticker in df.index:
+        return ticker
+    raise ValueError(f"未找到美股代码: {ticker}")
+
 def _handle_us_share(ticker: str, data_type: str, start_date: str = None, end_date: str = None):
     """处理美股查询"""
+    import akshare as ak
+
     ticker = ticker.upper()
     
-    # 优先解析带前缀的完整代码（AKShare美股接口通常需要前缀，如 105.NVDA）
-    full_symbol = ticker
-    
-    # 尝试通过实时接口获取完整代码
-    try:
-        df = ak.stock_us_spot_em()
-        # 匹配 symbol 后缀 (例如 105.NVDA -> NVDA)
-        matches = [code for code in df['代码'] if code.endswith(f".{ticker}")]
-        if not matches:
-             # 尝试直接匹配
-            matches = [code for code in df['代码'] if code == ticker]
-            
-        if matches:
-            full_symbol = matches[0]
-        elif data_type == "realtime":
-            # 如果是实时查询且找不到，直接报错
-             raise ValueError(f"未找到美股代码: {ticker}")
-    except Exception as e:
-        if data_type == "realtime":
-            raise e
-        # 历史查询时如果实时接口失败，尝试继续使用原始ticker（虽然可能失败）
-        pass
-
     if data_type == "realtime":
-        # 上面已经获取了df，这里直接返回筛选结果
-        return df[df['代码'] == full_symbol]
+        # 优先解析带前缀的完整代码（AKShare美股接口通常需要前缀，如 105.NVDA），找不到时直接报错
+        full_symbol = _us_full_symbol(ticker)
+        df, _ = _get_spot('us', ak.stock_us_spot_em, prepare=_index_us_spot)
+        try:
+            return df.loc[[full_symbol]]
+        except KeyError:
+            raise ValueError(f"未找到美股代码: {ticker}")
         
     elif data_type == "history":
+        try:
+            full_symbol = _us_full_symbol(ticker)
+        except Exception:
+            # 历史查询时如果无法解析完整代码，尝试继续使用原始ticker（虽然可能失败）
+            full_symbol = ticker
         if start_date and end_date:
             return ak.stock_us_hist(symbol=full_symbol, period="daily", start_date=start_date, end_date=end_date, adjust="qfq")
         else:
@@ -232,5 +432,3 @@ def _handle_us_share(ticker: str, data_type: str, start_date: str = None, end_da
         return {"code": ticker, "market": "US", "note": "美股基础信息接口待完善"}
     else:
         raise ValueError(f"不支持的数据类型: {data_type}")
-
-
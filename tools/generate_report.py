@@ -3,10 +3,58 @@
 介绍：生成专业Markdown格式报告工具函数
 """
 
+import re
 from typing import Dict, Union, List
-import json
 from datetime import datetime
 
+from utils.json_utils import loads
+
+# 报告类别关键词：一次正则扫描找出所有命中的关键词，再按类别优先级（列表顺序）取结果
+_TITLE_CATEGORIES = [
+    (("股票", "stock"), "股票投资分析报告"),
+    (("基金", "fund"), "基金投资分析报告"),
+    (("财务", "financial"), "财务数据分析报告"),
+]
+_FILENAME_CATEGORIES = [
+    (("股票",), "stock_analysis"),
+    (("基金",), "fund_analysis"),
+    (("财务",), "financial_analysis"),
+    (("投资",), "investment_analysis"),
+]
+
+
+def _compile_categories(categories: list, flags: int = 0):
+    """将类别关键词编译为单个正则及 关键词(小写) -> (优先级, 结果) 映射"""
+    keyword_map = {}
+    for priority, (keywords, value) in enumerate(categories):
+        for keyword in keywords:
+            keyword_map[keyword.lower()] = (priority, value)
+    pattern = re.compile("|".join(map(re.escape, keyword_map)), flags)
+    return pattern, keyword_map
+
+
+_TITLE_RE, _TITLE_MAP = _compile_categories(_TITLE_CATEGORIES, re.IGNORECASE)
+_FILENAME_RE, _FILENAME_MAP = _compile_categories(_FILENAME_CATEGORIES)
+
+
+class _SafeNameTable(dict):
+    """文件名字符过滤表（供 str.translate 使用）：保留字母、数字、空格、-、_，其余字符删除；按码位懒计算并缓存"""
+
+    def __missing__(self, codepoint: int):
+        char = chr(codepoint)
+        value = codepoint if char.isalnum() or char in " -_" else None
+        self[codepoint] = value
+        return value
+
+
+_SAFE_NAME_TABLE = _SafeNameTable()
+
+
+def _match_category(requirement: str, pattern, keyword_map: dict):
+    """单次扫描需求文本，返回优先级最高的类别结果，未命中时返回None"""
+    hits = {keyword_map[m.group(0).lower()] for m in pattern.finditer(requirement)}
+    return min(hits)[1] if hits else None
+
 
 def generate_markdown_report(user_requirement: str, report_content: str, save_to_file: bool = False, file_path: str = None) -> str:
     # todo 改为prompt生成内容
@@ -30,28 +78,34 @@ def generate_markdown_report(user_requirement: str, report_content: str, save_to
         # 生成报告标题
         title = _generate_title(user_requirement)
         
-        # 生成报告时间
-        report_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # 只检查一次内容数据，供数据、分析、风险、结论各部分共用
+        ctx = _analyze_content(content_data)
+        
+        # 生成报告时间（文件名中的时间戳也使用同一时间）
+        now = datetime.now()
+        report_time = now.strftime("%Y-%m-%d %H:%M:%S")
         
         # 构建Markdown报告
-        markdown_report = f"# {title}\n\n"
-        markdown_report += f"> 报告生成时间: {report_time}\n\n"
-        markdown_report += "## 📋 报告概述\n\n"
-        markdown_report += f"{user_requirement}\n\n"
-        markdown_report += "## 📊 数据分析\n\n"
-        markdown_report += f"{_format_content_section(content_data)}\n\n"
-        markdown_report += "## 📈 详细分析\n\n"
-        markdown_report += f"{_generate_detailed_analysis(content_data, user_requirement)}\n\n"
-        markdown_report += "## ⚠️ 风险提示\n\n"
-        markdown_report += f"{_generate_risk_assessment(content_data)}\n\n"
-        markdown_report += "## 📝 结论与建议\n\n"
-        markdown_report += f"{_generate_conclusion(content_data, user_requirement)}\n\n"
-        markdown_report += "---\n"
-        markdown_report += "*本报告由FinAgent自动生成*"
+        markdown_report = "".join([
+            f"# {title}\n\n",
+            f"> 报告生成时间: {report_time}\n\n",
+            "## 📋 报告概述\n\n",
+            f"{user_requirement}\n\n",
+            "## 📊 数据分析\n\n",
+            f"{_format_content_section(ctx)}\n\n",
+            "## 📈 详细分析\n\n",
+            f"{_generate_detailed_analysis(ctx, user_requirement)}\n\n",
+            "## ⚠️ 风险提示\n\n",
+            f"{_generate_risk_assessment(ctx)}\n\n",
+            "## 📝 结论与建议\n\n",
+            f"{_generate_conclusion(ctx, user_requirement)}\n\n",
+            "---\n",
+            "*本报告由FinAgent自动生成*",
+        ])
         
         # 如果需要保存到文件
         if save_to_file:
-            _save_markdown_report(markdown_report, file_path, user_requirement)
+            _save_markdown_report(markdown_report, file_path, user_requirement, timestamp=now.strftime("%Y%m%d_%H%M%S"))
         
         return markdown_report
         
@@ -61,108 +115,129 @@ def generate_markdown_report(user_requirement: str, report_content: str, save_to
 
 def _parse_content_data(content: str) -> Union[Dict, str]:
     """解析报告内容数据"""
+    # 不是以 { 或 [ 开头的内容不可能是JSON对象/数组，直接作为文本返回
+    stripped = content.lstrip()
+    if not stripped or stripped[0] not in "{[":
+        return content
     try:
         # 尝试解析为JSON
-        return json.loads(content)
-    except json.JSONDecodeError:
+        return loads(content)
+    except ValueError:
         # 如果不是JSON，返回原文本
         return content
 
 
 def _generate_title(requirement: str) -> str:
     """根据用户需求生成报告标题"""
-    if "股票" in requirement or "stock" in requirement.lower():
-        return "股票投资分析报告"
-    elif "基金" in requirement or "fund" in requirement.lower():
-        return "基金投资分析报告"
-    elif "财务" in requirement or "financial" in requirement.lower():
-        return "财务数据分析报告"
-    else:
-        return "专业分析报告"
+    return _match_category(requirement, _TITLE_RE, _TITLE_MAP) or "专业分析报告"
 
 
-def _format_content_section(content_data: Union[Dict, str]) -> str:
+def _safe_float(value, default: float = 0.0) -> float:
+    """将数值转换为float，无法转换时返回默认值"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _analyze_content(content_data: Union[Dict, str]) -> Dict:
+    """
+    单次检查内容数据，提取各报告部分共用的信息
+
+    Returns:
+        Dict: is_dict(是否为结构化数据)、data(原始数据)、change(涨跌幅，无该字段时为None)、
+              has_price(是否包含价格信息)、has_volume(是否包含成交量信息)
+    """
+    if not isinstance(content_data, dict):
+        return {"is_dict": False, "data": content_data, "change": None, "has_price": False, "has_volume": False}
+    
+    # 字典的文本形式只生成一次
+    data_text = str(content_data)
+    return {
+        "is_dict": True,
+        "data": content_data,
+        "change": _safe_float(content_data["change"]) if "change" in content_data else None,
+        "has_price": "price" in content_data or "股价" in data_text,
+        "has_volume": "volume" in content_data or "成交量" in data_text,
+    }
+
+
+def _format_content_section(ctx: Dict) -> str:
     """格式化内容数据部分"""
-    if isinstance(content_data, dict):
-        markdown_content = "### 原始数据\n\n"
-        markdown_content += "| 字段 | 值 |\n|------|-----|\n"
-        
-        for key, value in content_data.items():
-            markdown_content += f"| {key} | {value} |\n"
-        return markdown_content
+    if ctx["is_dict"]:
+        # 表格各行先收集再一次性拼接
+        rows = [f"| {key} | {value} |\n" for key, value in ctx["data"].items()]
+        return "### 原始数据\n\n| 字段 | 值 |\n|------|-----|\n" + "".join(rows)
     else:
-        return f"### 报告内容\n\n{content_data}"
+        return f"### 报告内容\n\n{ctx['data']}"
 
 
-def _generate_detailed_analysis(content_data: Union[Dict, str], requirement: str) -> str:
+def _generate_detailed_analysis(ctx: Dict, requirement: str) -> str:
     """生成详细分析部分"""
-    analysis = "### 分析要点\n\n"
+    parts = ["### 分析要点\n\n"]
     
-    if isinstance(content_data, dict):
+    if ctx["is_dict"]:
         # 基于数据类型生成相应的分析
-        if "price" in content_data or "股价" in str(content_data):
-            analysis += "- **价格分析**: "
-            if "change" in content_data and float(content_data.get("change", 0)) < 0:
-                analysis += "当前价格呈现下跌趋势，建议关注支撑位。\n"
+        if ctx["has_price"]:
+            if ctx["change"] is not None and ctx["change"] < 0:
+                parts.append("- **价格分析**: 当前价格呈现下跌趋势，建议关注支撑位。\n")
             else:
-                analysis += "当前价格走势相对稳定，可考虑逢低吸纳。\n"
+                parts.append("- **价格分析**: 当前价格走势相对稳定，可考虑逢低吸纳。\n")
         
-        if "volume" in content_data or "成交量" in str(content_data):
-            analysis += "- **成交量分析**: "
-            analysis += "成交量变化反映了市场活跃度，需结合价格走势综合判断。\n"
+        if ctx["has_volume"]:
+            parts.append("- **成交量分析**: 成交量变化反映了市场活跃度，需结合价格走势综合判断。\n")
     else:
-        analysis += "- 基于提供的内容进行综合分析\n"
+        parts.append("- 基于提供的内容进行综合分析\n")
     
-    analysis += f"- **需求匹配**: {requirement}\n"
-    return analysis
-
-
-def _generate_risk_assessment(content_data: Union[Dict, str]) -> str:
+    parts.append(f"- **需求匹配**: {requirement}\n")
+    return "".join(parts)
+
+
+# 风险提示部分的固定声明
+_RISK_STATEMENT = (
+    "### 投资风险提醒\n\n"
+    "⚠️ **重要声明**\n\n"
+    "1. 本报告仅供参考，不构成投资建议\n"
+    "2. 投资有风险，入市需谨慎\n"
+    "3. 建议结合多方信息进行独立判断\n"
+    "4. 过往表现不代表未来收益\n\n"
+)
+
+# 结论部分的固定操作建议
+_OPERATION_ADVICE = (
+    "\n**操作建议**:\n"
+    "- 建议分批建仓，控制仓位风险\n"
+    "- 设置合理的止损止盈点位\n"
+    "- 关注相关政策和市场动态\n"
+)
+
+
+def _generate_risk_assessment(ctx: Dict) -> str:
     """生成风险评估部分"""
-    risk_text = "### 投资风险提醒\n\n"
-    risk_text += "⚠️ **重要声明**\n\n"
-    risk_text += "1. 本报告仅供参考，不构成投资建议\n"
-    risk_text += "2. 投资有风险，入市需谨慎\n"
-    risk_text += "3. 建议结合多方信息进行独立判断\n"
-    risk_text += "4. 过往表现不代表未来收益\n\n"
-    
-    if isinstance(content_data, dict):
-        if "change" in content_data:
-            change_value = float(content_data.get("change", 0))
-            if abs(change_value) > 5:
-                risk_text += "🔴 **波动风险**: 价格波动较大，请注意风险控制\n"
-    
-    return risk_text
+    if ctx["change"] is not None and abs(ctx["change"]) > 5:
+        return _RISK_STATEMENT + "🔴 **波动风险**: 价格波动较大，请注意风险控制\n"
+    return _RISK_STATEMENT
 
 
-def _generate_conclusion(content_data: Union[Dict, str], requirement: str) -> str:
+def _generate_conclusion(ctx: Dict, requirement: str) -> str:
     """生成结论与建议部分"""
-    conclusion = "### 投资建议\n\n"
-    conclusion += "**综合评估**: "
-    
-    if isinstance(content_data, dict):
-        if "change" in content_data:
-            change_value = float(content_data.get("change", 0))
-            if change_value > 0:
-                conclusion += "短期趋势向好，可适当关注。\n"
-            elif change_value < 0:
-                conclusion += "短期存在回调压力，建议观望为主。\n"
-            else:
-                conclusion += "走势相对平稳，可根据个人风险偏好决策。\n"
+    if ctx["is_dict"]:
+        change_value = ctx["change"]
+        if change_value is None:
+            assessment = "建议进一步收集相关信息后再做判断。"
+        elif change_value > 0:
+            assessment = "短期趋势向好，可适当关注。"
+        elif change_value < 0:
+            assessment = "短期存在回调压力，建议观望为主。"
         else:
-            conclusion += "建议进一步收集相关信息后再做判断。\n"
+            assessment = "走势相对平稳，可根据个人风险偏好决策。"
     else:
-        conclusion += "建议结合更多数据指标进行综合分析。\n"
-    
-    conclusion += "\n**操作建议**:\n"
-    conclusion += "- 建议分批建仓，控制仓位风险\n"
-    conclusion += "- 设置合理的止损止盈点位\n"
-    conclusion += "- 关注相关政策和市场动态\n"
+        assessment = "建议结合更多数据指标进行综合分析。"
     
-    return conclusion
+    return f"### 投资建议\n\n**综合评估**: {assessment}\n{_OPERATION_ADVICE}"
 
 
-def _save_markdown_report(report_content: str, file_path: str = None, user_requirement: str = "") -> str:
+def _save_markdown_report(report_content: str, file_path: str = None, user_requirement: str = "", timestamp: str = None) -> str:
     """
     保存Markdown报告到文件
 
@@ -170,6 +245,7 @@ def _save_markdown_report(report_content: str, file_path: str = None, user_requi
         report_content (str): 要保存的报告内容
         file_path (str): 指定的文件路径，如果为None则自动生成
         user_requirement (str): 用户需求，用于生成文件名
+        timestamp (str): 文件名中的时间戳（YYYYmmdd_HHMMSS），为None时使用当前时间
 
     Returns:
         str: 实际保存的文件路径
@@ -184,7 +260,8 @@ def _save_markdown_report(report_content: str, file_path: str = None, user_requi
         if not file_path:
             # 自动生成文件名
             base_name = _generate_filename_from_requirement(user_requirement)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            if not timestamp:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"{base_name}_{timestamp}.md"
 
             # 获取当前文件所在目录的父目录
@@ -217,18 +294,12 @@ def _save_markdown_report(report_content: str, file_path: str = None, user_requi
 def _generate_filename_from_requirement(requirement: str) -> str:
     """根据用户需求生成文件名"""
     # 提取关键词
-    if "股票" in requirement:
-        return "stock_analysis"
-    elif "基金" in requirement:
-        return "fund_analysis"
-    elif "财务" in requirement:
-        return "financial_analysis"
-    elif "投资" in requirement:
-        return "investment_analysis"
+    category = _match_category(requirement, _FILENAME_RE, _FILENAME_MAP)
+    if category:
+        return category
     else:
         # 清理特殊字符，生成安全的文件名
-        safe_name = "".join(c for c in requirement[:20] if c.isalnum() or c in (' ', '-', '_'))
-        safe_name = safe_name.replace(' ', '_')
+        safe_name = requirement[:20].translate(_SAFE_NAME_TABLE).replace(' ', '_')
         return safe_name or "analysis_report"
 
 
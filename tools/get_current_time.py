@@ -7,9 +7,19 @@ from datetime import datetime
 from typing import Dict, Union
 
 
+# 单次Agent运行内共享的时间快照，保证同一计划的各步骤看到一致的时间
+_time_snapshot = None
+
+
+def reset_time_snapshot():
+    """清空时间快照，在每次Agent运行开始时调用"""
+    global _time_snapshot
+    _time_snapshot = None
+
+
 def get_current_time(time_format: str = "standard") -> Union[str, Dict]:
     """
-    获取当前时间
+    获取当前时间（同一次Agent运行内返回同一时间快照）
     
     Args:
         time_format (str): 时间格式，默认为"standard"
@@ -25,22 +35,27 @@ def get_current_time(time_format: str = "standard") -> Union[str, Dict]:
     Raises:
         ValueError: 当time_format参数不支持时抛出
     """
+    global _time_snapshot
     try:
-        now = datetime.now()
+        if _time_snapshot is None:
+            _time_snapshot = datetime.now()
+        now = _time_snapshot
         
         if time_format == "standard":
             return now.strftime("%Y-%m-%d %H:%M:%S")
         elif time_format == "timestamp":
-            return str(int(now.timestamp()))
+            return f"{int(now.timestamp())}"
         elif time_format == "detailed":
+            # 一次取出时间元组，避免逐个访问datetime属性
+            t = now.timetuple()
             return {
-                "year": now.year,
-                "month": now.month,
-                "day": now.day,
-                "hour": now.hour,
-                "minute": now.minute,
-                "second": now.second,
-                "weekday": now.weekday(),  # 0=Monday, 6=Sunday
+                "year": t.tm_year,
+                "month": t.tm_mon,
+                "day": t.tm_mday,
+                "hour": t.tm_hour,
+                "minute": t.tm_min,
+                "second": t.tm_sec,
+                "weekday": t.tm_wday,  # 0=Monday, 6=Sunday
                 "iso_format": now.isoformat(),
                 "timestamp": int(now.timestamp())
             }
@@ -1,8 +1,15 @@
 # tools/report_retriever.py
 
 from typing import List, Dict, Any
-from utils.rag import get_chroma_collection, query_chroma, load_and_preprocess_reports, add_documents_to_chroma
 import os
+import threading
+
+# 生成嵌入向量时的推理批大小
+EMBED_BATCH_SIZE = 128
+
+# 集合是否已确认非空（或已完成初始化），确认后不再每次查询 collection.count()
+_BOOTSTRAPPED = False
+_BOOTSTRAP_LOCK = threading.Lock()
 
 def retrieve_reports(query: str, n_results: int = 5, filters: Dict = None) -> List[Dict[str, Any]]:
     """
@@ -14,15 +21,23 @@ def retrieve_reports(query: str, n_results: int = 5, filters: Dict = None) -> Li
         n_results: 返回结果数量
         filters: 元数据过滤条件 (例如 {"ticker": "NVDA"})
     """
+    # utils.rag 会导入 chromadb 和嵌入模型相关依赖，推迟到首次检索时再导入
+    from utils.rag import get_chroma_collection, query_chroma, load_and_preprocess_reports, add_documents_to_chroma
+
+    global _BOOTSTRAPPED
     collection = get_chroma_collection()
     
-    # 检查集合是否为空，如果为空则加载并添加文档
-    if collection.count() == 0:
-        print("ChromaDB 集合为空，开始加载和预处理研报...")
-        reports_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "reports")
-        documents = load_and_preprocess_reports(reports_dir)
-        add_documents_to_chroma(documents, collection)
-        print(f"已向 ChromaDB 添加 {len(documents)} 个文档块。")
+    # 检查集合是否为空，如果为空则加载并添加文档（并发调用时只有一个线程执行初始化）
+    if not _BOOTSTRAPPED:
+        with _BOOTSTRAP_LOCK:
+            if not _BOOTSTRAPPED:
+                if collection.count() == 0:
+                    print("ChromaDB 集合为空，开始加载和预处理研报...")
+                    reports_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "reports")
+                    documents = load_and_preprocess_reports(reports_dir)
+                    add_documents_to_chroma(documents, collection, batch_size=EMBED_BATCH_SIZE)
+                    print(f"已向 ChromaDB 添加 {len(documents)} 个文档块。")
+                _BOOTSTRAPPED = True
 
     retrieved_docs = query_chroma(query, collection, n_results, where=filters)
     return retrieved_docs
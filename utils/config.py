@@ -4,7 +4,34 @@
 """
 import yaml
 from pathlib import Path
+from typing import Union
 
-def load_config(path: str = "config.yml"):
-    with open(Path(path), "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+# 优先使用libyaml提供的C实现加载器，未编译libyaml时退回纯Python实现
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
+# 默认配置文件：项目根目录下的 config.yml（模块加载时解析一次，不依赖当前工作目录）
+_DEFAULT_PATH = Path(__file__).resolve().parent.parent / "config.yml"
+
+# 配置缓存：路径 -> (文件修改时间, 解析结果)
+_CFG_CACHE: dict = {}
+
+
+def load_config(path: Union[str, Path, None] = None):
+    # 按路径缓存解析结果，文件修改时间不变时不再重新读取并解析YAML；返回的字典为共享对象，请勿修改
+    p = _DEFAULT_PATH if path is None else Path(path)
+    mtime = p.stat().st_mtime
+    hit = _CFG_CACHE.get(str(p))
+    if hit and hit[0] == mtime:
+        return hit[1]
+    with open(p, "r", encoding="utf-8") as f:
+        cfg = yaml.load(f, Loader=_Loader)
+    _CFG_CACHE[str(p)] = (mtime, cfg)
+    return cfg
+
+
+def reload_config():
+    """清除配置缓存，下次调用 load_config 时重新读取文件"""
+    _CFG_CACHE.clear()
@@ -0,0 +1,79 @@
+"""
+创建日期：2026年10月15日
+介绍：JSON编解码工具 - 安装了orjson时使用orjson，否则回退到标准库json，两者输出格式一致
+"""
+
+import json
+import re
+from typing import Any, Union
+
+# 尝试导入orjson（可选），C实现的编解码速度明显快于标准库
+try:
+    import orjson
+    has_orjson = True
+except ImportError:
+    has_orjson = False
+
+# LLM常把JSON包在```json ... ```代码块中，一次正则搜索取出代码块内容
+_JSON_FENCE = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.DOTALL)
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """
+    将对象编码为UTF-8 JSON字节串（紧凑格式，不转义非ASCII字符）
+
+    Args:
+        obj: 待编码对象
+        sort_keys: 是否按键排序（用于生成稳定的哈希键）
+
+    Returns:
+        JSON字节串
+    """
+    if has_orjson:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(obj, sort_keys=sort_keys, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """
+    解析JSON字节串或字符串
+
+    Args:
+        data: JSON字节串或字符串
+
+    Returns:
+        解析后的对象
+    """
+    if has_orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def extract_json(response: str) -> str:
+    """
+    提取LLM响应中的JSON文本：有代码块时取代码块内容，否则取整个响应
+
+    Args:
+        response: LLM原始响应
+
+    Returns:
+        去除代码块标记和首尾空白后的JSON文本
+    """
+    m = _JSON_FENCE.search(response)
+    return (m.group(1) if m else response).strip()
+
+
+def loads_llm_json(response: str) -> Any:
+    """
+    解析LLM返回的JSON（允许包裹在代码块中）
+
+    Args:
+        response: LLM原始响应
+
+    Returns:
+        解析后的对象
+
+    Raises:
+        ValueError: 响应不是合法JSON时抛出（json与orjson的解析异常均为ValueError子类）
+    """
+    return loads(extract_json(response))
@@ -5,6 +5,12 @@
 from fastmcp import FastMCP, Client
 import yaml
 import os
+import json
+import asyncio
+import functools
+import threading
+import time
+import weakref
 
 from .config import load_config
 from tools.akshare_search import akshare_search as _akshare_search
@@ -13,21 +19,59 @@ from tools.get_current_time import get_current_time as _get_current_time
 from tools.generate_report import generate_markdown_report as _generate_markdown_report
 from tools.report_retriever import retrieve_reports as _retrieve_reports
 
+# batch_execute并发调用上限，避免同时请求过多外部接口
+BATCH_CONCURRENCY = 10
+
+# 本地工具运行统计：工具名 -> {"calls": 调用次数, "errors": 失败次数, "latency_ms": 累计耗时}
+_tool_stats = {}
+# batch_execute并发时工具在线程池中运行，统计计数的读改写需要加锁
+_tool_stats_lock = threading.Lock()
+
 # 自定义MCP客户端
 _local_mcp_client = None
 _qieman_mcp_client = None
 
+# 远程MCP会话：每个事件循环、每个服务器地址复用一个已初始化的会话（SSE连接不能跨事件循环共享）
+_remote_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+# 持有远程连接的后台任务（保留引用，避免任务被垃圾回收）
+_remote_session_tasks = set()
+
 
 def create_local_mcp_server() -> FastMCP:
     """创建并配置FastMCP服务器"""
     mcp_local_server = FastMCP("FinAgent_local_MCP_Server")
+    # 已注册的本地工具（batch_execute按此分发）
+    local_tools = {}
     
-    @mcp_local_server.tool()
+    def local_tool(fn):
+        """注册本地工具：同时注册到MCP服务器和本地工具表，并记录调用次数与耗时"""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            failed = False
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                with _tool_stats_lock:
+                    stats = _tool_stats.setdefault(fn.__name__, {"calls": 0, "errors": 0, "latency_ms": 0.0})
+                    stats["calls"] += 1
+                    stats["errors"] += failed
+                    stats["latency_ms"] += elapsed_ms
+        
+        local_tools[fn.__name__] = wrapper
+        mcp_local_server.tool(wrapper)
+        return wrapper
+    
+    @local_tool
     def add(add1: int, add2: int) -> str:
         result = _add(add1, add2)
         return str(result)
     
-    @mcp_local_server.tool()
+    @local_tool
     def akshare_search(stock_code: str, data_type: str, start_date: str = None, end_date: str = None) -> str:
         if start_date and end_date:
             data = _akshare_search(stock_code, data_type, start_date, end_date)
@@ -35,24 +79,71 @@ def create_local_mcp_server() -> FastMCP:
             data = _akshare_search(stock_code, data_type)
         return str(data)
     
-    @mcp_local_server.tool()
+    @local_tool
     def get_current_time(time_format: str = "standard") -> str:
         data = _get_current_time(time_format)
         return str(data)
     
-    @mcp_local_server.tool()
+    @local_tool
     def generate_markdown_report(user_requirement: str, report_content: str) -> str:
         data = _generate_markdown_report(user_requirement, report_content, save_to_file=True)
         return str(data)
     
-    @mcp_local_server.tool()
+    @local_tool
     def retrieve_reports(query: str, n_results: int = 5, filters: dict = None) -> str:
         data = _retrieve_reports(query, n_results, filters)
         return str(data)
     
+    def run_operation(op: dict) -> dict:
+        """执行batch_execute中的单个工具调用"""
+        tool_name = op.get("tool")
+        try:
+            if tool_name == "batch_execute":
+                raise ValueError("batch_execute不允许嵌套调用")
+            if tool_name not in local_tools:
+                raise ValueError(f"未知的本地工具: {tool_name}")
+            result = local_tools[tool_name](**(op.get("args") or {}))
+            return {"tool": tool_name, "status": "success", "result": result}
+        except Exception as e:
+            return {"tool": tool_name, "status": "error", "result": str(e)}
+    
+    @mcp_local_server.tool()
+    async def batch_execute(operations: list[dict], stop_on_error: bool = True, concurrent: bool = True) -> str:
+        """
+        一次调用执行多个本地工具，operations格式为 [{"tool": 工具名, "args": 参数字典}, ...]
+        stop_on_error为True时按顺序执行，遇到第一个失败即停止，之后的操作不会执行；
+        stop_on_error为False且concurrent为True时各调用在线程池中并发执行（最多BATCH_CONCURRENCY个），返回全部结果
+        """
+        if concurrent and not stop_on_error:
+            semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+            
+            async def run_limited(op: dict) -> dict:
+                async with semaphore:
+                    return await asyncio.to_thread(run_operation, op)
+            
+            results = await asyncio.gather(*(run_limited(op) for op in operations))
+        else:
+            results = []
+            for op in operations:
+                # 顺序执行同样放到线程中，不阻塞并行分支和流式LLM调用共用的事件循环
+                results.append(await asyncio.to_thread(run_operation, op))
+                if stop_on_error and results[-1]["status"] == "error":
+                    break
+        
+        return json.dumps({"type": "tool_result", "tool": "batch_execute", "content": results}, ensure_ascii=False)
+    
     return mcp_local_server
 
 
+def get_tool_stats() -> dict:
+    """获取本地工具运行统计（调用次数、失败次数、累计及平均耗时）"""
+    with _tool_stats_lock:
+        return {
+            name: {**stats, "avg_latency_ms": stats["latency_ms"] / stats["calls"] if stats["calls"] else 0.0}
+            for name, stats in _tool_stats.items()
+        }
+
+
 def setup_local_mcp_client(server: FastMCP) -> Client:
     """创建并配置本地MCP客户端"""
     mcp_local_client = Client(server)
@@ -69,6 +160,52 @@ def get_local_mcp_client() -> Client:
     return _local_mcp_client
 
 
+async def _hold_remote_mcp_session(url: str, ready: asyncio.Future):
+    """在后台任务中建立并持有远程MCP会话，直到连接断开或事件循环结束（SSE连接的上下文必须在同一任务中进入和退出）"""
+    from mcp.client.session import ClientSession
+    from mcp.client.sse import sse_client
+
+    try:
+        async with sse_client(url) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                ready.set_result(session)
+                await asyncio.Event().wait()
+    except Exception as e:
+        if not ready.done():
+            ready.set_exception(e)
+        else:
+            print(f"远程MCP连接已断开（{url}）: {e}")
+    finally:
+        # 连接失败或断开后移除缓存，下次调用时重新连接
+        sessions = _remote_sessions.get(asyncio.get_running_loop())
+        if sessions is not None and sessions.get(url) is ready:
+            del sessions[url]
+
+
+async def get_remote_mcp_session(url: str):
+    """
+    获取远程MCP会话，同一事件循环内的调用共用一个连接（首次调用时建立连接并初始化）
+
+    Args:
+        url: 远程MCP服务器的SSE地址
+
+    Returns:
+        已初始化的 mcp ClientSession
+    """
+    loop = asyncio.get_running_loop()
+    sessions = _remote_sessions.setdefault(loop, {})
+    ready = sessions.get(url)
+    if ready is None:
+        ready = loop.create_future()
+        sessions[url] = ready
+        task = loop.create_task(_hold_remote_mcp_session(url, ready))
+        _remote_session_tasks.add(task)
+        task.add_done_callback(_remote_session_tasks.discard)
+    # shield：单个调用方被取消时不影响其他正在等待同一连接的调用
+    return await asyncio.shield(ready)
+
+
 def setup_qieman_mcp_client() -> Client:
     """创建并配置qieman MCP客户端"""
     try:
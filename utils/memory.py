@@ -6,8 +6,18 @@
 # todo 这里面有一些常量或者配置信息需要写出来
 from typing import Dict, List, Any, Optional, Tuple
 import os
-import json
+import re
+import atexit
+import copy
+import heapq
+import threading
+import time
+from collections import deque, OrderedDict
 from datetime import datetime
+from itertools import islice
+from operator import itemgetter
+
+from .json_utils import dumps
 
 # 尝试导入Chroma，如果没有安装则使用简单的相似度计算
 try:
@@ -21,13 +31,161 @@ except ImportError:
 
 # 尝试导入sentence-transformers，如果没有安装则使用简单的编码方式
 try:
+    import numpy as np
+    import torch
     from sentence_transformers import SentenceTransformer
-    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
     has_embedding_model = True
 except ImportError:
     has_embedding_model = False
     print("警告: sentence-transformers未安装，将使用简单的编码方式")
 
+# 记忆嵌入模型，首次使用时才加载；设备可通过环境变量 EMBED_DEVICE 指定（如 cpu、cuda），默认自动选择
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+# 推理精度（环境变量 EMBED_DTYPE）：auto 表示GPU上fp16、CPU上fp32；bf16 表示CPU上以bfloat16自动混合精度推理；fp32 表示始终使用fp32
+EMBED_DTYPE = os.environ.get("EMBED_DTYPE", "auto").lower()
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+
+
+def get_embedding_model() -> "SentenceTransformer":
+    """获取（首次调用时加载）记忆嵌入模型"""
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=os.environ.get("EMBED_DEVICE"))
+                if EMBED_DTYPE != "fp32" and model.device.type == "cuda":
+                    model.half()
+                _embedding_model = model
+    return _embedding_model
+
+
+def _encode(texts, **kwargs) -> "np.ndarray":
+    """
+    使用记忆嵌入模型编码文本（inference_mode下推理，按 EMBED_DTYPE 选择精度），返回float32 ndarray
+    
+    Args:
+        texts: 单条文本或文本列表
+        **kwargs: 传给 SentenceTransformer.encode 的其他参数
+    """
+    model = get_embedding_model()
+    with torch.inference_mode():
+        if EMBED_DTYPE == "bf16" and model.device.type == "cpu":
+            with torch.autocast(device_type="cpu", dtype=torch.bfloat16):
+                embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar=False, **kwargs)
+        else:
+            embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar=False, **kwargs)
+    # fp16/bf16推理的输出统一转换为float32
+    return embeddings.astype(np.float32, copy=False)
+
+
+def warmup_embedding_model():
+    """在后台线程中加载模型并编码一条短文本，使首次真正的编码调用不必等待模型加载和分词器初始化"""
+    def run():
+        try:
+            _encode(["warmup"])
+        except Exception as e:
+            print(f"嵌入模型预热失败: {e}")
+    
+    threading.Thread(target=run, name="embedding-warmup", daemon=True).start()
+
+
+# 批量生成记忆嵌入时的推理批大小
+EMBED_BATCH_SIZE = 64
+
+# 参与编码的最大字符数：模型只编码前 max_seq_length(256) 个token，超出部分预先截断以免分词整段长文本
+# （按字符截断是保守上界，截断后的文本仍不少于256个token，不影响嵌入结果；存储的记忆内容不截断）
+EMBED_MAX_CHARS = 2048
+
+# 嵌入向量缓存容量（文本 -> 嵌入向量，LRU淘汰）
+EMBED_CACHE_SIZE = 4096
+_EMBED_CACHE: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_EMBED_CACHE_LOCK = threading.Lock()
+
+# 内存备用存储中嵌入向量的int8量化比例（归一化向量分量 * 127）
+EMB_INT8_SCALE = 127.0
+
+# 搜索结果缓存：容量与有效期（秒）；添加新记忆后旧结果自动失效
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE_TTL = 60.0
+
+# Chroma写入缓冲容量：记忆先进入缓冲区，累计到该数量（或搜索、读取、进程退出）时一次写入
+WRITE_BUFFER_SIZE = 64
+
+# 对话摘要的token预算（按 字符数/4 粗略估算），限制摘要进入提示词的长度
+SUMMARY_TOKEN_BUDGET = 4000
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数（字符数/4），避免调用分词器"""
+    return len(text) // 4 + 1
+
+
+def match_metadata(metadata: Dict[str, Any], filter_metadata: Optional[Dict[str, Any]]) -> bool:
+    """判断记忆元数据是否满足过滤条件（各键值全部相等）"""
+    if not filter_metadata:
+        return True
+    return all(key in metadata and metadata[key] == value for key, value in filter_metadata.items())
+
+
+def to_chroma_where(filter_metadata: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """将元数据过滤条件转换为Chroma的where语法（多个条件需要用 $and 组合）"""
+    if not filter_metadata:
+        return None
+    if len(filter_metadata) == 1:
+        return dict(filter_metadata)
+    return {"$and": [{key: value} for key, value in filter_metadata.items()]}
+
+
+def _iso_timestamp(ts_ns: int) -> str:
+    """将纳秒时间戳格式化为ISO格式时间"""
+    return datetime.fromtimestamp(ts_ns / 1e9).isoformat()
+
+
+def _export_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    生成对外返回的记录副本
+    内部记录只保存纳秒时间戳 ts_ns（写入时不格式化时间），读出时换成ISO格式的 timestamp 字段
+    """
+    exported = {key: value for key, value in record.items() if key != "ts_ns"}
+    exported["timestamp"] = _iso_timestamp(record["ts_ns"])
+    return exported
+
+
+def embed_texts(texts: List[str]) -> "List[np.ndarray]":
+    """
+    生成文本的嵌入向量，结果按文本内容做LRU缓存
+    重复的记忆内容和查询直接复用缓存，未命中的文本去重后一次批量编码
+    
+    Args:
+        texts: 文本列表（需已安装sentence-transformers）
+    
+    Returns:
+        与 texts 顺序一致的嵌入向量列表（float32 ndarray，不转换为Python列表）
+    """
+    texts = [text[:EMBED_MAX_CHARS] for text in texts]
+    with _EMBED_CACHE_LOCK:
+        misses = list(dict.fromkeys(text for text in texts if text not in _EMBED_CACHE))
+    
+    if misses:
+        encoded = _encode(misses, batch_size=EMBED_BATCH_SIZE)
+        with _EMBED_CACHE_LOCK:
+            _EMBED_CACHE.update(zip(misses, encoded))
+    
+    with _EMBED_CACHE_LOCK:
+        embeddings = []
+        for text in texts:
+            embedding = _EMBED_CACHE.get(text)
+            if embedding is None:
+                # 极端情况下刚写入的条目已被其他线程淘汰，单独重新编码
+                embedding = _encode(text)
+                _EMBED_CACHE[text] = embedding
+            _EMBED_CACHE.move_to_end(text)
+            embeddings.append(embedding)
+        while len(_EMBED_CACHE) > EMBED_CACHE_SIZE:
+            _EMBED_CACHE.popitem(last=False)
+    return embeddings
+
 
 class ShortTermMemory:
     """短期记忆管理"""
@@ -40,9 +198,10 @@ class ShortTermMemory:
             capacity: 短期记忆容量，默认存储最近20轮对话
         """
         self.capacity = capacity
-        self.history = []  # 存储对话历史
+        self.history = deque(maxlen=capacity)  # 存储对话历史，超出容量时自动丢弃最早的消息
         self.current_state = {}  # 存储当前状态
         self.temporary_context = {}  # 存储临时上下文
+        self._summary_cache = None  # (max_tokens, 摘要)，历史变化时失效
     
     def add_message(self, role: str, content: str):
         """
@@ -55,14 +214,11 @@ class ShortTermMemory:
         message = {
             "role": role,
             "content": content,
-            "timestamp": datetime.now().isoformat()
+            "ts_ns": time.time_ns()
         }
         
         self.history.append(message)
-        
-        # 保持记忆容量
-        if len(self.history) > self.capacity:
-            self.history = self.history[-self.capacity:]
+        self._summary_cache = None
     
     def update_state(self, state: Dict[str, Any]):
         """
@@ -93,31 +249,52 @@ class ShortTermMemory:
             对话历史列表
         """
         if limit:
-            return self.history[-limit:]
-        return self.history
+            # 从deque尾部取最近limit条，不复制整个历史
+            recent = [_export_record(message) for message in islice(reversed(self.history), limit)]
+            recent.reverse()
+            return recent
+        return [_export_record(message) for message in self.history]
     
-    def get_summary(self) -> str:
+    def get_summary(self, max_tokens: int = SUMMARY_TOKEN_BUDGET) -> str:
         """
         获取对话摘要
         
+        Args:
+            max_tokens: 摘要的token预算，从最近的消息开始保留，超出预算的更早消息被丢弃
+        
         Returns:
             对话摘要
         """
         if not self.history:
             return ""
+        # 一轮对话中摘要会被多次读取（记忆转移、上下文构造、旧API），历史未变化时直接复用
+        if self._summary_cache is not None and self._summary_cache[0] == max_tokens:
+            return self._summary_cache[1]
         
-        # 生成对话摘要
+        # 生成对话摘要：只包含最近10条，且总长度不超过token预算
         summary = []
-        for message in self.history:
-            summary.append(f"{message['role']}: {message['content']}")
+        used_tokens = 0
+        for message in islice(reversed(self.history), 10):
+            line = f"{message['role']}: {message['content']}"
+            line_tokens = estimate_tokens(line)
+            if used_tokens + line_tokens > max_tokens:
+                if not summary:
+                    # 最近一条消息本身超出预算时保留其末尾部分
+                    summary.append(line[-max_tokens * 4:])
+                break
+            summary.append(line)
+            used_tokens += line_tokens
         
-        return "\n".join(summary[-10:])  # 只包含最近10条
+        result = "\n".join(reversed(summary))
+        self._summary_cache = (max_tokens, result)
+        return result
     
     def clear(self):
         """
         清空短期记忆
         """
-        self.history = []
+        self.history.clear()
+        self._summary_cache = None
         self.current_state = {}
         self.temporary_context = {}
 
@@ -129,8 +306,8 @@ class LongTermMemory:
         """
         初始化长期记忆
             - 同时维护内存备用存储（ self.memories ）和 Chroma 持久化存储
-                - 备用存储结构 ：列表，每个元素为一个字典，包含 content（文本内容）、metadata（元数据字典）、id（唯一标识符）、timestamp（创建时间）
-                - 持久化存储结构：documents（原始文本内容）, metadatas=[{**metadata, "timestamp": memory["timestamp"]}], ids（唯一标识符）, embeddings（存储文本的向量表示）
+                - 备用存储结构 ：列表，每个元素为一个字典，包含 content（文本内容）、metadata（元数据字典）、id（唯一标识符）、ts_ns（创建时间，纳秒时间戳）
+                - 持久化存储结构：documents（原始文本内容）, metadatas=[{**metadata, "timestamp": ISO格式的创建时间}], ids（唯一标识符）, embeddings（存储文本的向量表示）
             - Chroma 初始化 ：如果安装了 Chroma，调用 _init_chroma() 创建持久化客户端
             - 容错设计 ：即使 Chroma 不可用，也能通过内存存储保证基本功能
         
@@ -139,12 +316,27 @@ class LongTermMemory:
         """
         self.storage_path = storage_path
         self.memories = []  # 存储记忆对象（备用）
+        # 备用存储的嵌入矩阵：第i行为 self.memories[i] 的L2归一化嵌入（int8量化，按容量倍增预分配）
+        self._emb_matrix = None
+        # 备用存储中各记忆内容的小写形式（与 self.memories 一一对应），供文本匹配使用
+        self._contents_lower = []
+        # 搜索结果缓存：(查询, top_k, 版本) -> (缓存时间, 结果)；每次添加记忆版本号加一，旧结果不再命中
+        self._search_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._search_cache_lock = threading.Lock()
+        self._version = 0
+        # 记忆ID -> 元数据JSON文本（同一记忆的元数据不会改变，只序列化一次）
+        self._metadata_json = {}
         self.chroma_client = None
         self.collection = None  # Chroma持久化存储集合
+        # 待写入Chroma的记忆对象及其嵌入（两列一一对应）
+        self._write_buffer = {"memories": [], "embeddings": []}
+        self._write_lock = threading.Lock()
         
         # 初始化Chroma
         if has_chroma:
             self._init_chroma()
+            # 进程退出时写入缓冲区中剩余的记忆
+            atexit.register(self.flush)
     
     def _init_chroma(self):
         """
@@ -183,134 +375,290 @@ class LongTermMemory:
             content: 记忆内容
             metadata: 记忆元数据
         """
-        if metadata is None:
-            metadata = {}
+        self.add_memories([content], [metadata])
+    
+    def add_memories(self, contents: List[str], metadatas: List[Dict[str, Any]] = None):
+        """
+        批量添加记忆到长期记忆
+            - 嵌入向量按 EMBED_BATCH_SIZE 批量生成，记忆进入写入缓冲区，攒够 WRITE_BUFFER_SIZE 条后通过一次 collection.add 写入 Chroma
+            - 其余行为与 add_memory 相同
         
-        # 创建记忆对象
-        memory = {
-            "content": content,
-            "metadata": metadata,
-            "timestamp": datetime.now().isoformat(),
-            "id": f"memory_{len(self.memories)}_{datetime.now().timestamp()}"
-        }
+        Args:
+            contents: 记忆内容列表
+            metadatas: 记忆元数据列表，与 contents 一一对应
+        """
+        if not contents:
+            return
+        if metadatas is None:
+            metadatas = [None] * len(contents)
+        metadatas = [metadata or {} for metadata in metadatas]
         
-        # 添加到内存存储（备用）
-        self.memories.append(memory)
+        # 创建记忆对象（同一批记忆共用一个时间戳，ISO格式的时间在写入Chroma或读出时才生成）
+        ts_ns = time.time_ns()
+        start = len(self.memories)
+        memories = [
+            {
+                "content": content,
+                "metadata": metadata,
+                "ts_ns": ts_ns,
+                "id": f"memory_{start + i}_{ts_ns}"
+            }
+            for i, (content, metadata) in enumerate(zip(contents, metadatas))
+        ]
         
-        # 添加到Chroma
-        if has_chroma and self.collection:
+        # 批量生成嵌入（如果有模型）
+        embeddings = None
+        if has_embedding_model:
             try:
-                # 生成嵌入（如果有模型）
-                embedding = None
-                if has_embedding_model:
-                    embedding = embedding_model.encode(content).tolist()
-                
-                # 添加到集合
-                self.collection.add(
-                    documents=[content],
-                    metadatas=[{
-                        **metadata,
-                        "timestamp": memory["timestamp"]
-                    }],
-                    ids=[memory["id"]],
-                    embeddings=[embedding] if embedding else None
-                )
-                
-                print(f"记忆已添加到Chroma: {content[:100]}...")
+                embeddings = embed_texts(contents)
             except Exception as e:
-                print(f"添加到Chroma失败: {e}")
+                print(f"生成记忆嵌入失败: {e}")
+        
+        # 添加到内存存储（备用）
+        self._append_embeddings(start, embeddings)
+        self.memories.extend(memories)
+        self._contents_lower.extend(content.lower() for content in contents)
+        self._version += 1
+        
+        preview = contents[0][:100] if len(contents) == 1 else f"{len(contents)} 条记忆"
+        
+        # 添加到Chroma（先进入写入缓冲区，攒够一批后一次写入）
+        if has_chroma and self.collection:
+            with self._write_lock:
+                buffer = self._write_buffer
+                buffer["memories"].extend(memories)
+                buffer["embeddings"].extend(embeddings if embeddings is not None else [None] * len(contents))
+                buffered = len(buffer["memories"])
+            print(f"记忆已加入Chroma写入缓冲: {preview}...")
+            if buffered >= WRITE_BUFFER_SIZE:
+                self.flush()
         else:
             # 如果没有Chroma，只存储到内存
-            print(f"记忆已添加到内存存储: {content[:100]}...")
+            print(f"记忆已添加到内存存储: {preview}...")
     
-    def search(self, query: str, top_k: int = 5) -> List[Tuple[Dict[str, Any], float]]:
+    def flush(self):
+        """
+        将写入缓冲区中的记忆一次性写入Chroma
+        """
+        if not self.collection:
+            return
+        with self._write_lock:
+            buffer = self._write_buffer
+            if not buffer["memories"]:
+                return
+            self._write_buffer = {"memories": [], "embeddings": []}
+        memories = buffer["memories"]
+        
+        # 只要有一条记忆缺少嵌入，就交由Chroma统一编码整批文档
+        embeddings = buffer["embeddings"]
+        if any(embedding is None for embedding in embeddings):
+            embeddings = None
+        else:
+            # 直接以 (n, dim) 的float32 ndarray 传给Chroma，不再转换为嵌套列表
+            embeddings = np.stack(embeddings).astype(np.float32, copy=False)
+        try:
+            self.collection.add(
+                documents=[memory["content"] for memory in memories],
+                metadatas=[{**memory["metadata"], "timestamp": _iso_timestamp(memory["ts_ns"])} for memory in memories],
+                ids=[memory["id"] for memory in memories],
+                embeddings=embeddings
+            )
+            print(f"已向Chroma写入 {len(memories)} 条记忆")
+        except Exception as e:
+            print(f"添加到Chroma失败: {e}")
+    
+    def _append_embeddings(self, start: int, embeddings: "Optional[List[np.ndarray]]"):
+        """
+        将新记忆的嵌入写入备用存储的嵌入矩阵（第 start 行起）
+        没有嵌入时（未安装模型或编码失败）不再维护矩阵，备用搜索退回文本匹配
+        """
+        if embeddings is None or (start > 0 and self._emb_matrix is None):
+            self._emb_matrix = None
+            return
+        
+        rows = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        rows /= np.maximum(norms, 1e-12)
+        # 归一化后各分量都在[-1, 1]内，用固定比例对称量化为int8，新增记忆无需重新量化已有行
+        rows = np.round(rows * EMB_INT8_SCALE).astype(np.int8)
+        
+        end = start + len(rows)
+        if self._emb_matrix is None or end > len(self._emb_matrix):
+            # 容量不足时按倍数扩容，避免每次添加都复制整个矩阵
+            capacity = max(end, 2 * (0 if self._emb_matrix is None else len(self._emb_matrix)), 64)
+            matrix = np.zeros((capacity, rows.shape[1]), dtype=np.int8)
+            if self._emb_matrix is not None:
+                matrix[:start] = self._emb_matrix[:start]
+            self._emb_matrix = matrix
+        self._emb_matrix[start:end] = rows
+    
+    def search(self, query: str, top_k: int = 5, filter_metadata: Dict[str, Any] = None) -> List[Tuple[Dict[str, Any], float]]:
         """
         搜索相关记忆
         
         Args:
             query: 搜索查询
             top_k: 返回的结果数量
+            filter_metadata: 元数据过滤条件，只在满足条件的记忆中搜索
             
         Returns:
             相关记忆列表，每个元素包含记忆对象和相似度得分
         """
-        results = []
+        # 相同查询在有效期内且期间没有新增记忆时直接返回缓存结果
+        filter_key = frozenset(filter_metadata.items()) if filter_metadata else None
+        key = (query, top_k, filter_key, self._version)
+        now = time.monotonic()
+        with self._search_cache_lock:
+            hit = self._search_cache.get(key)
+            if hit and now - hit[0] < SEARCH_CACHE_TTL:
+                self._search_cache.move_to_end(key)
+                return copy.deepcopy(hit[1])
+        
+        results = self.search_batch([query], top_k, filter_metadata)[0]
+        
+        with self._search_cache_lock:
+            self._search_cache[key] = (now, copy.deepcopy(results))
+            self._search_cache.move_to_end(key)
+            while len(self._search_cache) > SEARCH_CACHE_SIZE:
+                self._search_cache.popitem(last=False)
+        # 缓存中保存的是深拷贝（含嵌套的metadata），调用方修改结果不会影响缓存
+        return results
+    
+    def search_batch(self, queries: List[str], top_k: int = 5, filter_metadata: Dict[str, Any] = None) -> List[List[Tuple[Dict[str, Any], float]]]:
+        """
+        批量搜索相关记忆：所有查询一次编码，并通过一次Chroma查询（或一次矩阵乘法）得到结果
+        
+        Args:
+            queries: 搜索查询列表
+            top_k: 每个查询返回的结果数量
+            filter_metadata: 元数据过滤条件，Chroma中作为where条件在服务端过滤
+            
+        Returns:
+            与 queries 顺序一致的结果列表，每个元素为该查询的相关记忆列表（记忆对象和相似度得分）
+        """
+        if not queries:
+            return []
         
         # 使用Chroma搜索
         if has_chroma and self.collection:
+            # 先写入缓冲区中的记忆，保证能搜索到刚添加的内容
+            self.flush()
             try:
-                # 生成查询嵌入（如果有模型）
-                query_embedding = None
+                # 生成查询嵌入（如果有模型），与写入时使用同一模型和缓存；没有模型时由Chroma自行编码查询文本
+                query_kwargs = {"query_texts": list(queries)}
                 if has_embedding_model:
-                    query_embedding = embedding_model.encode(query).tolist()
+                    query_kwargs = {"query_embeddings": np.stack(embed_texts(queries)).astype(np.float32, copy=False)}
                 
                 # 搜索
                 # 确保n_results至少为1
                 n_results = min(top_k, len(self.memories)) if len(self.memories) > 0 else top_k
                 n_results = max(n_results, 1)  # 确保至少为1
                 
+                where = to_chroma_where(filter_metadata)
+                if where:
+                    query_kwargs["where"] = where
+                
                 chroma_results = self.collection.query(
-                    query_texts=[query],
+                    **query_kwargs,
                     n_results=n_results,
                     include=["documents", "metadatas", "distances"]
                 )
                 
-                # 处理结果
-                for i in range(len(chroma_results["ids"][0])):
-                    doc_id = chroma_results["ids"][0][i]
-                    document = chroma_results["documents"][0][i]
-                    metadata = chroma_results["metadatas"][0][i]
-                    distance = chroma_results["distances"][0][i]
-                    
-                    # 转换距离为相似度（0-1）
-                    similarity = 1.0 / (1.0 + distance)
-                    
-                    # 构建记忆对象
-                    memory = {
-                        "id": doc_id,
-                        "content": document,
-                        "metadata": metadata
-                    }
-                    
-                    results.append((memory, similarity))
+                # 处理结果：构建记忆对象，并将距离转换为相似度（0-1）
+                return [
+                    [
+                        ({"id": doc_id, "content": document, "metadata": metadata}, 1.0 / (1.0 + distance))
+                        for doc_id, document, metadata, distance in zip(ids, documents, metadatas, distances)
+                    ]
+                    for ids, documents, metadatas, distances in zip(
+                        chroma_results["ids"],
+                        chroma_results["documents"],
+                        chroma_results["metadatas"],
+                        chroma_results["distances"]
+                    )
+                ]
             except Exception as e:
                 print(f"Chroma搜索失败: {e}")
-                # 失败时使用备用方法
-                results = self._search_fallback(query, top_k)
-        else:
-            # 使用备用搜索方法
-            results = self._search_fallback(query, top_k)
         
-        return results
+        # 使用备用搜索方法（Chroma不可用或搜索失败时）
+        return self._search_fallback(queries, top_k, filter_metadata)
     
-    def _search_fallback(self, query: str, top_k: int = 5) -> List[Tuple[Dict[str, Any], float]]:
+    def _search_fallback(self, queries: List[str], top_k: int = 5, filter_metadata: Dict[str, Any] = None) -> List[List[Tuple[Dict[str, Any], float]]]:
         """
         备用搜索方法（当Chroma不可用时）
         
+        Args:
+            queries: 搜索查询列表
+            top_k: 每个查询返回的结果数量
+            filter_metadata: 元数据过滤条件
+            
+        Returns:
+            与 queries 顺序一致的相关记忆列表
+        """
+        # 有嵌入矩阵时按余弦相似度搜索：所有查询一次矩阵乘法（GEMM）得到得分，再只对每行前top_k排序
+        n = len(self.memories)
+        if self._emb_matrix is not None and n > 0 and top_k > 0:
+            try:
+                # 有过滤条件时只对满足条件的行计算得分
+                if filter_metadata:
+                    rows = np.array([i for i, memory in enumerate(self.memories) if match_metadata(memory["metadata"], filter_metadata)], dtype=np.intp)
+                    matrix = self._emb_matrix[rows]
+                else:
+                    rows = np.arange(n)
+                    matrix = self._emb_matrix[:n]
+                if len(rows) == 0:
+                    return [[] for _ in queries]
+                
+                q = np.asarray(embed_texts(queries), dtype=np.float32)
+                q /= np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+                # 以int8存储，计算时转换为float32走BLAS（int8取值在float32中可精确表示），再除以量化比例还原余弦相似度
+                scores = (q @ matrix.astype(np.float32).T) / EMB_INT8_SCALE
+                k = min(top_k, len(rows))
+                tops = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                results = []
+                for row, top in zip(scores, tops):
+                    top = top[np.argsort(-row[top])]
+                    results.append([(_export_record(self.memories[rows[i]]), float(row[i])) for i in top])
+                return results
+            except Exception as e:
+                print(f"向量搜索失败，改用文本匹配: {e}")
+        
+        return [self._search_text(query, top_k, filter_metadata) for query in queries]
+    
+    def _search_text(self, query: str, top_k: int = 5, filter_metadata: Dict[str, Any] = None) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        基于文本包含关系的搜索（没有嵌入模型时）
+        
         Args:
             query: 搜索查询
             top_k: 返回的结果数量
+            filter_metadata: 元数据过滤条件
             
         Returns:
             相关记忆列表
         """
         results = []
+        query_lower = query.lower()
+        # 所有关键词编译为一个正则，每条记忆只需一次C层面的扫描即可判断是否包含任一关键词
+        keywords = query_lower.split()
+        keyword_re = re.compile("|".join(map(re.escape, keywords))) if keywords else None
         
         # 简单的文本匹配
-        for memory in self.memories:
+        for memory, content_lower in zip(self.memories, self._contents_lower):
+            if filter_metadata and not match_metadata(memory["metadata"], filter_metadata):
+                continue
             # 计算简单的文本相似度（包含关系）
             similarity = 0.0
-            if query.lower() in memory["content"].lower():
+            if query_lower in content_lower:
                 similarity = 0.8
-            elif any(keyword in memory["content"].lower() for keyword in query.lower().split()):
+            elif keyword_re and keyword_re.search(content_lower):
                 similarity = 0.5
             
             if similarity > 0:
                 results.append((memory, similarity))
         
-        # 按相似度排序
-        results.sort(key=lambda x: x[1], reverse=True)
-        return results[:top_k]
+        # 只需要前top_k个结果，用堆选择代替整体排序（得分相同时保持原有顺序）
+        return [(_export_record(memory), score) for memory, score in heapq.nlargest(top_k, results, key=itemgetter(1))]
     
     def get_all_memories(self) -> List[Dict[str, Any]]:
         """
@@ -319,36 +667,38 @@ class LongTermMemory:
         Returns:
             所有长期记忆的列表
         """
-        memories = []
-        
         # 从内存存储获取
-        for memory in self.memories:
-            memories.append({
+        memories = [
+            {
                 "id": memory["id"],
                 "content": memory["content"],
                 "metadata": memory["metadata"],
-                "timestamp": memory["timestamp"]
-            })
+                "timestamp": _iso_timestamp(memory["ts_ns"])
+            }
+            for memory in self.memories
+        ]
         
         # 如果有Chroma，尝试从Chroma获取（可能更完整）
         if has_chroma and self.collection:
             try:
-                # 从Chroma获取所有文档
+                # 从Chroma获取所有文档（先写入缓冲区中的记忆）
+                self.flush()
                 chroma_results = self.collection.get()
                 
                 # 构建记忆列表
-                chroma_memories = []
-                for i, (doc, metadata, id_) in enumerate(zip(
-                    chroma_results.get("documents", []),
-                    chroma_results.get("metadatas", []),
-                    chroma_results.get("ids", [])
-                )):
-                    chroma_memories.append({
+                chroma_memories = [
+                    {
                         "id": id_,
                         "content": doc,
                         "metadata": metadata,
                         "timestamp": metadata.get("timestamp", "N/A")
-                    })
+                    }
+                    for doc, metadata, id_ in zip(
+                        chroma_results.get("documents", []),
+                        chroma_results.get("metadatas", []),
+                        chroma_results.get("ids", [])
+                    )
+                ]
                 
                 # 如果Chroma数据更完整，使用Chroma数据
                 if chroma_memories:
@@ -364,6 +714,22 @@ class LongTermMemory:
         
         return memories
     
+    def metadata_json(self, memory: Dict[str, Any]) -> str:
+        """
+        获取记忆元数据的JSON文本（按记忆ID缓存，使用orjson时为C实现）
+        
+        Args:
+            memory: 记忆对象（需包含 id 和 metadata）
+        
+        Returns:
+            元数据JSON文本
+        """
+        text = self._metadata_json.get(memory["id"])
+        if text is None:
+            text = dumps(memory["metadata"]).decode("utf-8")
+            self._metadata_json[memory["id"]] = text
+        return text
+    
     def show_all_memories(self):
         """
         显示所有存储的长期记忆（格式化输出）
@@ -385,7 +751,7 @@ class LongTermMemory:
             print(f"时间: {memory['timestamp']}")
             print(f"内容: {memory['content'][:200]}..." if len(memory['content']) > 200 else f"内容: {memory['content']}")
             if memory['metadata']:
-                print(f"元数据: {json.dumps(memory['metadata'], ensure_ascii=False)}")
+                print(f"元数据: {self.metadata_json(memory)}")
         
         print("\n" + "=" * 80)
         print(f"总计: {len(memories)} 条记忆")
@@ -405,6 +771,11 @@ class MemoryManager:
         """
         self.short_term = ShortTermMemory(short_term_capacity)
         self.long_term = LongTermMemory(storage_path)
+        self._last_summary_hash = None  # 上次已处理（转移或判定为重复）的摘要哈希
+        
+        # 后台预热嵌入模型，不阻塞模块导入
+        if has_embedding_model:
+            warmup_embedding_model()
     
     def add_message(self, role: str, content: str):
         """
@@ -448,6 +819,11 @@ class MemoryManager:
             # 提取对话摘要
             summary = self.short_term.get_summary()
             
+            # 摘要与上次处理时相同，无需再编码和查询
+            summary_hash = hash(summary)
+            if summary_hash == self._last_summary_hash:
+                return
+            
             # 检查是否已经存在相似的记忆
             existing_memories = self.long_term.search(summary, top_k=1)
             
@@ -460,6 +836,8 @@ class MemoryManager:
                 }
                 self.long_term.add_memory(summary, metadata)
                 print(f"记忆已转移到长期存储: {summary[:100]}...")
+            
+            self._last_summary_hash = summary_hash
     
     def retrieve_relevant_memories(self, query: str, top_k: int = 3, filter_metadata: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """
@@ -473,21 +851,8 @@ class MemoryManager:
         Returns:
             相关记忆列表
         """
-        results = self.long_term.search(query, top_k)
-        
-        # 如果有过滤条件，进一步过滤结果
-        if filter_metadata:
-            filtered_results = []
-            for memory, score in results:
-                match = True
-                for key, value in filter_metadata.items():
-                    if key not in memory["metadata"] or memory["metadata"][key] != value:
-                        match = False
-                        break
-                if match:
-                    filtered_results.append(memory)
-            return filtered_results
-        
+        # 过滤条件随查询一起下发（Chroma中为where条件），返回满足条件的前top_k条
+        results = self.long_term.search(query, top_k, filter_metadata)
         return [memory for memory, _ in results]
     
     def get_all_long_term_memories(self) -> List[Dict[str, Any]]:
@@ -527,13 +892,13 @@ class MemoryManager:
             # 构建长期记忆上下文
             long_term_context = ""
             if relevant_memories:
-                long_term_context = "\n## 相关历史信息\n"
+                parts = ["\n## 相关历史信息\n"]
                 for i, memory in enumerate(relevant_memories, 1):
-                    long_term_context += f"### 记忆 {i}\n"
-                    long_term_context += f"{memory['content']}\n"
+                    parts.append(f"### 记忆 {i}\n{memory['content']}\n")
                     if memory['metadata']:
-                        long_term_context += f"元数据: {json.dumps(memory['metadata'], ensure_ascii=False)}\n"
-                    long_term_context += "\n"
+                        parts.append(f"元数据: {self.long_term.metadata_json(memory)}\n")
+                    parts.append("\n")
+                long_term_context = "".join(parts)
             
             # 组合上下文
             combined_context = short_term_context + long_term_context
@@ -573,9 +938,15 @@ class MemoryManager:
 # 全局记忆管理器实例
 memory_manager = MemoryManager()
 
-# 兼容旧的API接口
-history = []
-summary = ""
+# 兼容旧的API接口：模块属性 history / summary 在读取时才从记忆管理器生成（PEP 562），
+# 不再在每次添加消息后复制整个对话历史到全局变量
+def __getattr__(name: str):
+    if name == "history":
+        return memory_manager.get_history()
+    if name == "summary":
+        return memory_manager.get_summary()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 def update_summary(model: str):
     """
@@ -584,15 +955,9 @@ def update_summary(model: str):
     Args:
         model: 使用的语言模型名称
     """
-    global summary
-    
     # 从记忆管理器获取摘要
     summary = memory_manager.get_summary()
     
-    # 将历史记录同步到全局变量
-    global history
-    history = memory_manager.get_history()
-    
     print(f"[{model}] Summary updated: {summary}")
 
 
@@ -606,10 +971,29 @@ def add_message(role: str, content: str):
         content: 消息内容
     """
     memory_manager.add_message(role, content)
+
+
+def get_history(limit: int = None) -> List[Dict[str, Any]]:
+    """
+    获取最新的对话历史
     
-    # 同步到全局变量
-    global history
-    history = memory_manager.get_history()
+    Args:
+        limit: 只返回最近limit条记录，为None时返回全部
+        
+    Returns:
+        对话历史列表
+    """
+    return memory_manager.get_history(limit)
+
+
+def get_summary() -> str:
+    """
+    获取最新的对话摘要
+    
+    Returns:
+        对话摘要
+    """
+    return memory_manager.get_summary()
 
 
 def get_relevant_memories(query: str, top_k: int = 3, filter_metadata: Dict[str, Any] = None) -> List[Dict[str, Any]]:
@@ -3,83 +3,324 @@
 介绍：Agent节点函数定义
 """
 
-from typing import Dict, List, Any, Optional
-from dataclasses import dataclass
-import asyncio
+from typing import Annotated, Dict, List, Any, Optional
+from dataclasses import dataclass, field, replace
+import operator
+import re
 
-from click import Tuple
+from langgraph.config import get_stream_writer
 
-from .utils import generate_text, _call_tool_async
+from .utils import generate_text_async, generate_text_stream_async, _call_tool_async
+from .json_utils import dumps, loads_llm_json
+from .memory import get_history, get_summary
 
-# 定义状态结构
-@dataclass
+# 定义状态结构（slots：节点频繁读取状态字段，属性访问不再经过__dict__）
+@dataclass(slots=True)
 class AgentState:
     user_input: str
-    current_plan: List[Dict[str, str]]
-    current_step: int
-    execution_results: List[Dict[str, Any]]
-    completed: bool
-    final_answer: Optional[str]
+    current_plan: List[Dict[str, str]] = field(default_factory=list)
+    current_step: int = 0
+    # 并行执行的步骤各自只返回本步结果，由reducer合并
+    execution_results: Annotated[List[Dict[str, Any]], operator.add] = field(default_factory=list)
+    completed: bool = False
+    final_answer: Optional[str] = None
+    # 命中的计划模板（见 utils/plan_cache.py），非空时plan节点改为adapt
+    plan_template: Optional[List[Dict[str, Any]]] = None
+    # 执行结果的文本摘要，每个步骤只追加自己的一行（由reducer拼接），避免每步重新拼接全部结果
+    execution_summary: Annotated[str, operator.add] = ""
+    # 因步骤失败而重新规划的次数，达到 MAX_REPLANS 后不再重新规划
+    replan_count: int = 0
 
 
-# Plan节点 - 生成执行计划
-def plan_node(state: AgentState) -> Dict[str, Any]:
-    """生成执行计划"""
-    # 动态导入获取最新的history和summary
-    from .memory import history, summary
-
-
-    # todo 定义可用的工具列表
-    tool_candidates = [
-        {"tool_name": "add", "description": "两数相加"},
-        {"stock_data": "add", "description": "获取指定股票的历史行情数据"},
-        {"SearchFinancialNews": "add", "description": "根据关键词和时间范围搜索财经资讯内容"},
-        {"get_current_time": "add", "description": "获取当前时间工具"},
-        {"generate_markdown_report": "add", "description": "生成Markdown报告工具"},
-        {"retrieve_reports": "add", "description": "研报检索工具"},
-    ]
+def independent_steps(state: AgentState) -> List[int]:
+    """
+    从当前步骤开始，找出依赖均已完成、可以并行执行的一批步骤
 
-    prompt_template = """
-        ## 要求
-        基于用户需求和对话上下文，生成一个详细的执行计划，每一步计划包含：
-            1. 步骤编号
-            2. 步骤描述
-            3. 需要执行的操作
-            4. 需要调用的工具
-        对于每一步计划，需要判断是否需要调用工具：如果需要，则需要从tools_candidate中确定需要的工具名；若不需要，则输入None
-        示例格式：
-        [
-            {{
-                "step": 1,
-                "description": "步骤1描述",
-                "action": "需要执行的操作",
-                "tool": "需要调用的工具",
-            }},
-            ...
-        ]
-
-        ## 当前对话上下文: 
-        {summary}
-        
-        ## 用户当前需求: 
-        {user_input}
-        
-        ## tool_candidates: 
-        {tool_candidates}
+    Args:
+        state: 当前状态
+
+    Returns:
+        可并行执行的步骤索引列表（至少包含当前步骤，全部执行完毕时为空）
     """
+    plan = state.current_plan
+    start = state.current_step
+    if start >= len(plan):
+        return []
+
+    done = {item.get("step") for item in plan[:start]}
+    batch = [start]
+    for i in range(start + 1, len(plan)):
+        depends_on = plan[i].get("depends_on")
+        # 未声明依赖或依赖尚未完成时，保守地留到下一轮按顺序执行
+        if depends_on is None or not set(depends_on) <= done:
+            break
+        batch.append(i)
+    return batch
+
+
+# todo 定义可用的工具列表
+TOOL_CANDIDATES = [
+    {"tool_name": "add", "description": "两数相加"},
+    {"stock_data": "add", "description": "获取指定股票的历史行情数据"},
+    {"SearchFinancialNews": "add", "description": "根据关键词和时间范围搜索财经资讯内容"},
+    {"get_current_time": "add", "description": "获取当前时间工具"},
+    {"generate_markdown_report": "add", "description": "生成Markdown报告工具"},
+    {"retrieve_reports": "add", "description": "研报检索工具"},
+    {"batch_execute": "add", "description": "批量调用多个本地工具（add、akshare_search、get_current_time、generate_markdown_report、retrieve_reports），多个互不依赖的本地工具调用应合并为一步"},
+]
+
+# 提示词按"静态前缀 + 动态后缀"拆分：规则、示例、工具定义等不变内容放在最前面并作为独立的首条消息发送，
+# 每次请求的前缀完全一致，Ollama可复用前缀的KV缓存、Gemini可命中隐式前缀缓存，只需对动态后缀做prefill
+STATIC_PLAN_PREFIX = """
+    ## 要求
+    基于用户需求和对话上下文，生成一个详细的执行计划，每一步计划包含：
+        1. 步骤编号
+        2. 步骤描述
+        3. 需要执行的操作
+        4. 需要调用的工具
+        5. 依赖的前序步骤编号列表
+    对于每一步计划，需要判断是否需要调用工具：如果需要，则需要从tools_candidate中确定需要的工具名；若不需要，则输入None
+    对于每一步计划，需要列出它依赖哪些前序步骤的结果：不依赖任何步骤则输入空列表，这样的步骤可以并行执行
+    示例格式：
+    [
+        {
+            "step": 1,
+            "description": "步骤1描述",
+            "action": "需要执行的操作",
+            "tool": "需要调用的工具",
+            "depends_on": []
+        },
+        ...
+    ]
+
+    ## tool_candidates: 
+    """ + str(TOOL_CANDIDATES) + "\n"
+
+DYNAMIC_PLAN_SUFFIX = """
+    ## 当前对话上下文: 
+    {summary}
+    
+    ## 用户当前需求: 
+    {user_input}
+"""
+
+# todo 构造参数分析提示，补充新的工具，工具的参数名参考mcp_server.py
+# todo 后续考虑将工具参数定义写出来
+TOOL_SCHEMA = {
+    "add": {
+        "description": "加法计算工具",
+        "parameters": {
+            "add1": {"type": "int", "description": "第一个加数"},
+            "add2": {"type": "int", "description": "第二个加数"}
+        }
+    },
+    # "akshare_search": {
+    #     "description": "股票数据查询工具",
+    #     "parameters": {
+    #         "stock_code": {"type": "str", "description": "股票代码"},
+    #         "data_type": {
+    #             "type": "str",
+    #             "description": "数据类型",
+    #             "enum": [
+    #                 {"value": "realtime", "description": "实时行情（用户查询当前或最新行情时使用）"},
+    #                 {"value": "history", "description": "历史数据（用户查询指定日期范围的历史行情时使用）"},
+    #                 {"value": "info", "description": "基本信息（用户查询股票基本信息时使用）"}
+    #             ]
+    #         },
+    #         "start_date": {"type": "str", "description": "开始日期（可选，格式: YYYYMMDD）"},
+    #         "end_date": {"type": "str", "description": "结束日期（可选，格式: YYYYMMDD）"}
+    #     }
+    # },
+    "stock_data": {
+        "description": "获取指定股票的历史行情数据",
+        "parameters": {
+            "code": {"type": "str", "description": "股票代码，如'000001.SZ'表示平安银行(A股)，'AAPL'表示苹果(美股)，'00700.HK'表示腾讯(港股)，'USDCNH.FXCM'表示美元人民币(外汇)，'CU2501.SHF'表示铜期货，'159919.SZ'表示沪深300ETF(基金)，'204001.SH'表示GC001国债逆回购，'113008.SH'表示可转债，'10001313.SH'表示期权合约"},
+            "market_type": {
+                "type": "str", 
+                "description": "市场类型，选一个",
+                "enum": [
+                    {"value": "cn", "description": "A股"},
+                    {"value": "us", "description": "美股"},
+                    {"value": "hk", "description": "港股"},
+                    {"value": "fx", "description": "外汇"},
+                    {"value": "futures", "description": "期货"},
+                    {"value": "fund", "description": "债券逆回购"},
+                    {"value": "repo", "description": "基金"},
+                    {"value": "convertible_bond", "description": "可转债"},
+                    {"value": "options", "description": "期权"},
+                ]
+            },
+            "start_date": {"type": "str", "description": "起始日期，格式为YYYYMMDD，如'20230101'（可选）"},
+            "end_date": {"type": "str", "description": "结束日期，格式为YYYYMMDD，如'20230131'（可选）"},
+            "indicators": {
+                "type": "str", 
+                "description": "需要计算的技术指标，多个指标用空格分隔。若使用指标则必须明确指定参数，例如：'macd(12,26,9) rsi(14) kdj(9,3,3) boll(20,2) ma(10)'",
+                "enum": [
+                    {"value": "macd", "description": "MACD指标"},
+                    {"value": "rsi", "description": "相对强弱指标"},
+                    {"value": "kdj", "description": "随机指标"},
+                    {"value": "boll", "description": "布林带"},
+                    {"value": "ma", "description": "均线指标"}
+                ]
+            }
+        }
+    },
+    "SearchFinancialNews": {
+        "description": "根据关键词和时间范围搜索财经资讯内容",
+        "parameters": {
+            "keyword": {"type": "str", "description": "搜索关键词；示例：“股票”"},
+            "startDate": {"type": "int", "description": "搜索开始日期（YYYY-MM-DD）；示例：“2024-01-01”（可选）"},
+            "endDate": {"type": "dict", "description": "搜索结束日期（YYYY-MM-DD）；示例：“2024-03-20”（可选）"},
+            "page": {"type": "int", "description": "页码（可选，默认为1）"},
+            "pageSize": {"type": "int", "description": "每页数量（可选，默认为20）"}
+        }
+    },
+    "get_current_time": {
+        "description": "获取当前时间工具",
+        "parameters": {}
+    },
+    "generate_markdown_report": {
+        "description": "生成Markdown报告工具",
+        "parameters": {
+            "user_requirement": {"type": "str", "description": "用户需求"},
+            "report_content": {"type": "str", "description": "报告内容"}
+        }
+    },
+    "retrieve_reports": {
+        "description": "研报检索工具",
+        "parameters": {
+            "query": {"type": "str", "description": "用户查询文本"},
+            "n_results": {"type": "int", "description": "返回的研报数量（可选，默认为5）"},
+            "filters": {"type": "dict", "description": "元数据过滤条件（可选，例如 {'ticker': 'NVDA'}）"}
+        }
+    },
+    "batch_execute": {
+        "description": "批量调用多个本地工具，一次分发执行",
+        "parameters": {
+            "operations": {"type": "list", "description": "工具调用列表，每项格式为 {'tool': '工具名', 'args': {参数字典}}，工具名只能是add、akshare_search、get_current_time、generate_markdown_report、retrieve_reports"},
+            "stop_on_error": {"type": "bool", "description": "某个调用失败时是否停止后续调用（可选，默认为true）"},
+            "concurrent": {"type": "bool", "description": "是否并发执行各调用（可选，默认为true；只在stop_on_error为false时生效，stop_on_error为true时总是按顺序执行；后一个调用依赖前一个调用时设为false）"}
+        }
+    }
+}
+
+# 工具参数定义只在模块加载时序列化一次（紧凑JSON，减少提示词token数）
+TOOL_SCHEMA_JSON = dumps(TOOL_SCHEMA).decode("utf-8")
+
+# 各工具的必填参数（描述中未标注“可选”的参数），用于判断计划给出的参数是否已完整
+_REQUIRED_ARGS = {
+    name: frozenset(k for k, v in spec["parameters"].items() if "可选" not in v["description"])
+    for name, spec in TOOL_SCHEMA.items()
+}
+
+STATIC_PARAM_PREFIX = """
+    ## 要求
+    请分析任务需要调用指定工具时的具体参数：根据任务描述和原始需求，分析出调用该工具所需的参数。
+
+    ## 工具参数定义：
+    """ + TOOL_SCHEMA_JSON + """
+    
+    ## 回答格式：
+    {
+        "分析": "你的分析过程",
+        "参数": {
+            "参数1名称": "参数1值",
+            "参数2名称": "参数2值"
+        }
+    }
+"""
+
+DYNAMIC_PARAM_SUFFIX = """
+    ## 当前任务
+    需要调用的工具: "{tool_name}"
+    任务描述: {action}
+    用户原始需求: {user_input}
+    前序步骤执行结果: {execution_summary}
+"""
+
+# 其余节点的提示词，同样按静态前缀 + 动态后缀拆分
+ADAPT_PLAN_PREFIX = """
+    ## 要求
+    下面是一个已验证可行的执行计划模板，其中 {ticker}、{date} 等占位符需要替换为用户当前需求中的具体股票代码、日期等实体。
+    请保持步骤结构和工具不变，只替换占位符并按需微调步骤描述，输出与模板相同格式的JSON列表，不要输出其他内容。
+"""
+
+ADAPT_PLAN_SUFFIX = """
+    ## 计划模板:
+    {template}
+    
+    ## 用户当前需求:
+    {user_input}
+"""
+
+ANSWER_PREFIX = """
+    基于以下执行结果和用户原始需求，生成一个简洁明了的最终答案。
+    请根据执行结果，直接回答用户的问题。答案应该是具体的、有针对性的。
+    只需输出最终答案，不需要解释过程。
+"""
+
+ANSWER_SUFFIX = """
+    用户原始需求: {user_input}
+    执行结果: {execution_results}
+"""
 
-    # 格式化提示文本
-    prompt_text = prompt_template.format(
+REPLAN_PREFIX = """
+    基于当前执行结果和对话历史，重新生成执行计划。
+    请根据以下信息，重新生成一个执行计划，包含剩余需要执行的步骤。
+"""
+
+REPLAN_SUFFIX = """
+    对话历史:
+    {history_text}
+    
+    当前对话摘要:
+    {summary}
+    
+    原始用户需求: {user_input}
+    当前执行计划: {current_plan}
+    已执行步骤: {current_step}
+    执行结果: {execution_results}
+"""
+
+
+# Plan节点 - 生成执行计划
+async def plan_node(state: AgentState) -> Dict[str, Any]:
+    """生成执行计划"""
+    if state.plan_template:
+        try:
+            return await adapt_plan_node(state, state.plan_template)
+        except ValueError as e:
+            # 模板适配的响应不是合法JSON时退回完整规划
+            print(f"计划模板适配失败，改为完整规划: {e}")
+
+    # 静态前缀在模块加载时已渲染，每次只拼接对话上下文和用户需求
+    prompt_text = DYNAMIC_PLAN_SUFFIX.format(
         user_input=state.user_input,
-        summary=summary,
-        tool_candidates=tool_candidates
+        summary=get_summary()
     )
     # 调用LLM生成计划
-    content = generate_text(prompt_text)
+    content = await generate_text_async(prompt_text, prefix=STATIC_PLAN_PREFIX)
+
+    # 解析计划（兼容包裹在```json代码块中的响应）
+    plan = loads_llm_json(content)
+    return {
+        "current_plan": plan,
+        "current_step": 0,
+        "execution_results": [],
+        "completed": False
+    }
+
+
+# Adapt节点 - 基于缓存的计划模板生成执行计划
+async def adapt_plan_node(state: AgentState, template: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """将命中的计划模板绑定到当前需求的具体实体上（比完整规划更轻量的LLM调用）"""
+    prompt_text = ADAPT_PLAN_SUFFIX.format(
+        user_input=state.user_input,
+        template=template
+    )
+    content = await generate_text_async(prompt_text, prefix=ADAPT_PLAN_PREFIX)
 
-    # 解析计划（实际项目中可能需要更复杂的解析）
-    import json
-    plan = json.loads(content)
+    plan = loads_llm_json(content)
     return {
         "current_plan": plan,
         "current_step": 0,
@@ -88,292 +329,199 @@ def plan_node(state: AgentState) -> Dict[str, Any]:
     }
 
 
+def _ready_tool_args(tool_name: str, tool_args: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    判断能否跳过参数分析直接调用工具
+
+    Args:
+        tool_name: 工具名
+        tool_args: 计划步骤中给出的参数（可能没有）
+
+    Returns:
+        工具无参数时返回空字典；计划给出的参数包含全部必填参数且没有空值时返回该参数；否则返回None（需要LLM分析参数）
+    """
+    required = _REQUIRED_ARGS.get(tool_name)
+    if required is None:
+        return None
+    if not required and not tool_args:
+        return {}
+    if isinstance(tool_args, dict) and required <= tool_args.keys() and None not in tool_args.values():
+        return tool_args
+    return None
+
+
+# 写入execution_summary的单步结果最大字符数，超出部分截断（参数分析、重新规划的提示词只需要结果概要，
+# 完整结果保留在execution_results中，只用于生成最终答案）
+RESULT_SUMMARY_CHARS = 2000
+
+
+def _truncate_result(result: Any) -> str:
+    """截断过长的步骤结果，用于execution_summary"""
+    text = str(result)
+    if len(text) <= RESULT_SUMMARY_CHARS:
+        return text
+    return f"{text[:RESULT_SUMMARY_CHARS]}...（省略{len(text) - RESULT_SUMMARY_CHARS}字）"
+
+
+# execute_node写入结果的失败标记，replan_node据此判断是否需要重新规划
+# （batch_execute中单个操作失败时以 "status": "error" 报告；akshare_search多只股票查询中失败的代码以"查询失败"报告）
+_FAILURE_RE = re.compile(r'工具调用失败|JSON解析失败|参数分析失败|查询失败|"status":\s*"error"')
+
+
+# 步骤失败时最多重新规划的次数，超过后直接基于（含失败信息的）执行结果生成最终答案，
+# 避免工具持续失败（远程MCP不可用、代码错误等）时反复重新规划直到触发recursion_limit
+MAX_REPLANS = 2
+
+
+def is_failed_result(result: Any) -> bool:
+    """步骤结果是否带有失败标记"""
+    return bool(_FAILURE_RE.search(str(result)))
+
+
+async def _invoke_tool(tool_name: str, tool_args: Dict[str, Any]):
+    """调用工具，失败时返回错误说明作为本步结果"""
+    try:
+        return await _call_tool_async(tool_name, tool_args)
+    except Exception as e:
+        return f"{tool_name}工具调用失败: {str(e)}"
+
+
 # 执行节点 - 执行计划的当前步骤
-def execute_node(state: AgentState) -> Dict[str, Any]:
-    """执行计划的当前步骤"""
+async def execute_node(state: AgentState) -> Dict[str, Any]:
+    """执行计划的当前步骤（由Send分发，state.current_step为本次要执行的步骤索引）"""
     if state.current_step >= len(state.current_plan):
         # 所有步骤执行完毕，准备生成最终答案
         return {
             "completed": True
         }
 
+    # 计划步骤保持普通字典（展示、计划模板缓存、checkpoint序列化都按字典处理），需要的字段只读取一次
     current_task = state.current_plan[state.current_step]
+    step = current_task["step"]
     action = current_task["action"]
     tool_name = current_task.get("tool", None)
-    execution_summary = "\n".join([f"步骤{res['step']}: {res['result']}" for res in state.execution_results])
+    execution_summary = state.execution_summary
     print(f"执行结果：{execution_summary}\n")
 
     # 如果计划中指定了工具，则调用工具
     if tool_name and tool_name != "None":
-
-        # "akshare_search": {{
-        #     "description": "股票数据查询工具",
-        #     "parameters": {{
-        #         "stock_code": {{"type": "str", "description": "股票代码"}},
-        #         "data_type": {{
-        #             "type": "str",
-        #             "description": "数据类型",
-        #             "enum": [
-        #                 {{"value": "realtime", "description": "实时行情（用户查询当前或最新行情时使用）"}},
-        #                 {{"value": "history", "description": "历史数据（用户查询指定日期范围的历史行情时使用）"}},
-        #                 {{"value": "info", "description": "基本信息（用户查询股票基本信息时使用）"}}
-        #             ]
-        #         }},
-        #         "start_date": {{"type": "str", "description": "开始日期（可选，格式: YYYYMMDD）"}},
-        #         "end_date": {{"type": "str", "description": "结束日期（可选，格式: YYYYMMDD）"}}
-        #     }}
-        # }},
-
-        # todo 构造参数分析提示，补充新的工具，工具的参数名参考mcp_server.py
-        # todo 后续考虑将工具参数定义写出来
-        prompt_template = """
-            ## 要求
-            请分析以下任务需要调用工具"{tool_name}"时的具体参数。
-            任务描述: {action}
-            用户原始需求: {user_input}
-            前序步骤执行结果: {execution_summary}
-
-            请根据任务描述和原始需求，分析出调用该工具所需的参数。
-
-            ## 工具参数定义：
-            {{
-                "add": {{
-                    "description": "加法计算工具",
-                    "parameters": {{
-                        "add1": {{"type": "int", "description": "第一个加数"}},
-                        "add2": {{"type": "int", "description": "第二个加数"}}
-                    }}
-                }},
-                "stock_data": {{
-                    "description": "获取指定股票的历史行情数据",
-                    "parameters": {{
-                        "code": {{"type": "str", "description": "股票代码，如'000001.SZ'表示平安银行(A股)，'AAPL'表示苹果(美股)，'00700.HK'表示腾讯(港股)，'USDCNH.FXCM'表示美元人民币(外汇)，'CU2501.SHF'表示铜期货，'159919.SZ'表示沪深300ETF(基金)，'204001.SH'表示GC001国债逆回购，'113008.SH'表示可转债，'10001313.SH'表示期权合约"}},
-                        "market_type": {{
-                            "type": "str", 
-                            "description": "市场类型，选一个",
-                            "enum": [
-                                {{"value": "cn", "description": "A股"}},
-                                {{"value": "us", "description": "美股"}},
-                                {{"value": "hk", "description": "港股"}},
-                                {{"value": "fx", "description": "外汇"}},
-                                {{"value": "futures", "description": "期货"}},
-                                {{"value": "fund", "description": "债券逆回购"}},
-                                {{"value": "repo", "description": "基金"}},
-                                {{"value": "convertible_bond", "description": "可转债"}},
-                                {{"value": "options", "description": "期权"}},
-                            ]
-                        }},
-                        "start_date": {{"type": "str", "description": "起始日期，格式为YYYYMMDD，如'20230101'（可选）"}},
-                        "end_date": {{"type": "str", "description": "结束日期，格式为YYYYMMDD，如'20230131'（可选）"}},
-                        "indicators": {{
-                            "type": "str", 
-                            "description": "需要计算的技术指标，多个指标用空格分隔。若使用指标则必须明确指定参数，例如：'macd(12,26,9) rsi(14) kdj(9,3,3) boll(20,2) ma(10)'",
-                            "enum": [
-                                {{"value": "macd", "description": "MACD指标"}},
-                                {{"value": "rsi", "description": "相对强弱指标"}},
-                                {{"value": "kdj", "description": "随机指标"}},
-                                {{"value": "boll", "description": "布林带"}},
-                                {{"value": "ma", "description": "均线指标"}}
-                            ]
-                        }}
-                    }}
-                }},
-                "SearchFinancialNews": {{
-                    "description": "根据关键词和时间范围搜索财经资讯内容",
-                    "parameters": {{
-                        "keyword": {{"type": "str", "description": "搜索关键词；示例：“股票”"}},
-                        "startDate": {{"type": "int", "description": "搜索开始日期（YYYY-MM-DD）；示例：“2024-01-01”（可选）"}},
-                        "endDate": {{"type": "dict", "description": "搜索结束日期（YYYY-MM-DD）；示例：“2024-03-20”（可选）"}},
-                        "page": {{"type": "int", "description": "页码（可选，默认为1）"}},
-                        "pageSize": {{"type": "int", "description": "每页数量（可选，默认为20）"}}
-                    }}
-                }},
-                "get_current_time": {{
-                    "description": "获取当前时间工具",
-                    "parameters": {{}}
-                }},
-                "generate_markdown_report": {{
-                    "description": "生成Markdown报告工具",
-                    "parameters": {{
-                        "user_requirement": {{"type": "str", "description": "用户需求"}},
-                        "report_content": {{"type": "str", "description": "报告内容"}}
-                    }}
-                }},
-                "retrieve_reports": {{
-                    "description": "研报检索工具",
-                    "parameters": {{
-                        "query": {{"type": "str", "description": "用户查询文本"}},
-                        "n_results": {{"type": "int", "description": "返回的研报数量（可选，默认为5）"}},
-                        "filters": {{"type": "dict", "description": "元数据过滤条件（可选，例如 {{'ticker': 'NVDA'}}）"}}
-                    }}
-                }}
-            }}
-            
-            ## 回答格式：
-            {{
-                "分析": "你的分析过程",
-                "参数": {{
-                    "参数1名称": "参数1值",
-                    "参数2名称": "参数2值"
-                }}
-            }}
-        """
-
-        # 调用大模型分析参数
-        prompt_text = prompt_template.format(
-            tool_name=tool_name, 
-            action=action, 
-            user_input=state.user_input,
-            execution_summary=execution_summary
-        )
-        param_analysis = generate_text(prompt_text)
-        try:
-            import json
-            analysis_result = json.loads(param_analysis)
-            print(f"====={analysis_result}")
-            tool_args = analysis_result.get("参数", {})
-            
+        tool_args = _ready_tool_args(tool_name, current_task.get("tool_args"))
+        if tool_args is not None:
+            # 工具无需参数或计划已给出完整参数，跳过参数分析的LLM调用
+            result = await _invoke_tool(tool_name, tool_args)
+        else:
+            # 调用大模型分析参数
+            prompt_text = DYNAMIC_PARAM_SUFFIX.format(
+                tool_name=tool_name, 
+                action=action, 
+                user_input=state.user_input,
+                execution_summary=execution_summary
+            )
+            param_analysis = await generate_text_async(prompt_text, prefix=STATIC_PARAM_PREFIX)
             try:
-                result = asyncio.run(_call_tool_async(tool_name, tool_args))
-            except Exception as e:
-                result = f"{tool_name}工具调用失败: {str(e)}"
+                analysis_result = loads_llm_json(param_analysis)
+                print(f"====={analysis_result}")
+                tool_args = analysis_result.get("参数", {})
+                result = await _invoke_tool(tool_name, tool_args)
             
-        except json.JSONDecodeError as e:
-            result = f"JSON解析失败: {str(e)}，原始响应: {param_analysis}"
+            except ValueError as e:
+                result = f"JSON解析失败: {str(e)}，原始响应: {param_analysis}"
 
-        except Exception as e:
-            result = f"参数分析失败: {str(e)}，原始响应: {param_analysis}"
+            except Exception as e:
+                result = f"参数分析失败: {str(e)}，原始响应: {param_analysis}"
     else:
         # 对于不需要工具的任务，直接执行
         result = f"任务执行: {action}"
 
     # 记录执行结果
     execution_result = {
-        "step": current_task["step"],
+        "step": step,
         "description": current_task["description"],
-        "action": current_task["action"],
+        "action": action,
         "result": result
     }
 
-    new_results = state.execution_results.copy()
-    new_results.append(execution_result)
-
+    # 只返回本步结果（并行执行时由reducer合并），步骤指针由replan节点统一推进
     return {
-        "execution_results": new_results,
-        "current_step": state.current_step + 1
+        "execution_results": [execution_result],
+        "execution_summary": f"步骤{step}: {_truncate_result(result)}\n"
     }
 
 
-def replan_node(state: AgentState) -> Dict[str, Any]:
-    """根据执行结果重新生成计划或生成最终答案（每步执行后检查）"""
-    # 动态导入获取最新的history和summary
-    from .memory import history, summary
+async def replan_node(state: AgentState) -> Dict[str, Any]:
+    """根据执行结果重新生成计划或生成最终答案（每批步骤执行后检查）"""
+    # 刚执行完的这一批步骤已合并到execution_results，推进步骤指针
+    batch_size = len(independent_steps(state))
+    state = replace(state, current_step=state.current_step + batch_size)
     
-    # 准备对话历史和摘要
-    history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history[-5:]])
-    
-    # 构造检查提示，让大模型判断是否需要继续执行或生成答案
-    prompt_template = """
-        基于当前执行情况，请判断下一步应该做什么：
-
-        用户原始需求: {user_input}
-        当前执行进度: {current_step}/{total_steps}
-        已完成的执行结果: {execution_results}
-        
-        重要提示：
-        - 如果还有未执行的步骤（当前步骤 < 总步骤数），必须选择"1"继续执行
-        - 只有当所有步骤都执行完毕后，才能选择"2"生成最终答案
-        - 如果当前步骤执行失败，才选择"3"重新规划
-        
-        请选择最合适的选项：
-        1. 继续执行下一个步骤（当还有未执行的步骤时）
-        2. 生成最终答案（只有当所有步骤都执行完毕后）
-        3. 重新规划计划（如果当前步骤执行失败）
-        
-        请只回答数字1、2或3。
-    """
-    
-    # 格式化提示文本
-    execution_summary = "\n".join([f"步骤{res['step']}: {res['result']}" for res in state.execution_results])
-    prompt_text = prompt_template.format(
-        user_input=state.user_input,
-        current_step=state.current_step,
-        total_steps=len(state.current_plan),
-        execution_results=execution_summary
-    )
-    
-    # 调用大模型进行判断
-    decision = generate_text(prompt_text).strip()
-    
-    print(f"  🤖 AI决策: {decision}")  # 调试输出
+    # 按执行进度和本批结果直接决定下一步，不再调用LLM判断：
+    # 本批有步骤失败 -> 3 重新规划（包括最后一批，重新规划次数用完时 -> 2）；全部步骤执行完毕 -> 2 生成最终答案；否则 -> 1 继续执行
+    batch_results = state.execution_results[len(state.execution_results) - batch_size:] if batch_size else []
+    if any(is_failed_result(res["result"]) for res in batch_results):
+        if state.replan_count < MAX_REPLANS:
+            decision = "3"
+        else:
+            print(f"  ⚠️ 已重新规划{state.replan_count}次，基于现有执行结果生成答案")
+            decision = "2"
+    elif state.current_step >= len(state.current_plan):
+        decision = "2"
+    else:
+        decision = "1"
+    print(f"  🤖 决策: {decision}")  # 调试输出
     
     # 根据决策采取行动
-    if decision.startswith("2") or state.current_step >= len(state.current_plan):
-        # 生成最终答案
-        answer_prompt = """
-            基于以下执行结果和用户原始需求，生成一个简洁明了的最终答案。
-            
-            用户原始需求: {user_input}
-            执行结果: {execution_results}
-            
-            请根据执行结果，直接回答用户的问题。答案应该是具体的、有针对性的。
-            
-            只需输出最终答案，不需要解释过程。
-        """
-        
-        answer_text = answer_prompt.format(
+    if decision == "2":
+        # 生成最终答案（使用未截断的完整执行结果）
+        answer_text = ANSWER_SUFFIX.format(
             user_input=state.user_input,
-            execution_results=execution_summary
+            execution_results="\n".join([f"步骤{res['step']}: {res['result']}" for res in state.execution_results])
         )
         
-        final_answer = generate_text(answer_text)
+        # 流式生成最终答案，每段文本通过custom流推送给调用方，首个token到达即可显示
+        writer = get_stream_writer()
+        chunks = []
+        async for chunk in generate_text_stream_async(answer_text, prefix=ANSWER_PREFIX):
+            chunks.append(chunk)
+            writer({"final_answer_chunk": chunk})
+        final_answer = "".join(chunks)
         
         return {
+            "current_step": state.current_step,
             "completed": True,
             "final_answer": final_answer.strip()
         }
     
-    elif decision.startswith("3"):
-        # 重新规划计划
-        replan_prompt = """
-        基于当前执行结果和对话历史，重新生成执行计划。
-
-        对话历史:
-        {history_text}
-        
-        当前对话摘要:
-        {summary}
-        
-        原始用户需求: {user_input}
-        当前执行计划: {current_plan}
-        已执行步骤: {current_step}
-        执行结果: {execution_results}
-        
-        请根据以上信息，重新生成一个执行计划，包含剩余需要执行的步骤。
-        """
-        
-        replan_text = replan_prompt.format(
+    elif decision == "3":
+        # 重新规划计划（对话历史只在这一分支用到）
+        history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in get_history(5)])
+        replan_text = REPLAN_SUFFIX.format(
             user_input=state.user_input,
             current_plan=state.current_plan,
             current_step=state.current_step,
-            execution_results=execution_summary,
+            execution_results=state.execution_summary,
             history_text=history_text,
-            summary=summary
+            summary=get_summary()
         )
         
-        content = generate_text(replan_text)
+        # 重新规划发生在执行失败之后，跳过响应缓存，避免重复拿到同一个失败的计划
+        content = await generate_text_async(replan_text, prefix=REPLAN_PREFIX, use_cache=False)
         
         # 解析新计划
-        import json
         try:
-            new_plan = json.loads(content)
+            new_plan = loads_llm_json(content)
             return {
                 "current_plan": new_plan,
-                "current_step": 0  # 重置步骤计数
+                "current_step": 0,  # 重置步骤计数
+                "replan_count": state.replan_count + 1
+            }
+        except ValueError as e:
+            # 如果解析失败，保持原有计划（同样计入重新规划次数）
+            print(f"  ⚠️ 重新规划结果解析失败，继续执行原计划: {e}")
+            return {
+                "current_plan": state.current_plan,
+                "current_step": state.current_step,
+                "replan_count": state.replan_count + 1
             }
-        except:
-            # 如果解析失败，保持原有计划
-            pass
     
     # 默认情况下继续执行当前计划
     return {
@@ -0,0 +1,150 @@
+"""
+创建日期：2026年10月15日
+介绍：计划模板缓存 - 按用户目标的向量检索历史成功计划，命中时只需让LLM做实体替换而不必重新规划
+"""
+
+import hashlib
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from .json_utils import dumps, loads
+
+PLAN_COLLECTION_NAME = "plan_templates"
+DEFAULT_THRESHOLD = 0.90
+
+# 计划参数中需要抽象成占位符的具体实体：日期按格式识别；股票代码只取自表示代码的参数，
+# 不按大写单词猜测（MACD、ETF等指标和术语不是股票代码）
+_DATE_RE = re.compile(r"(?<!\d)(?:\d{4}-\d{2}-\d{2}|\d{8})(?!\d)")
+_TICKER_KEYS = ("stock_code", "code")
+
+_collection = None
+
+
+def plan_cache_enabled() -> bool:
+    """是否启用计划模板缓存（环境变量 PLAN_CACHE=1），查询需要加载嵌入模型和Chroma，默认关闭"""
+    return os.environ.get("PLAN_CACHE") == "1"
+
+
+def _get_collection():
+    """获取（或创建）计划模板集合，使用余弦距离"""
+    global _collection
+    if _collection is None:
+        import chromadb
+        from .rag import CHROMA_DB_PATH
+        client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+        _collection = client.get_or_create_collection(
+            name=PLAN_COLLECTION_NAME,
+            metadata={"hnsw:space": "cosine", "description": "Plan模板缓存"}
+        )
+    return _collection
+
+
+def _embed(text: str) -> List[float]:
+    """使用与RAG相同的模型生成目标向量"""
+    from .rag import get_model
+    return get_model().encode(text, normalize_embeddings=True).tolist()
+
+
+def _plan_tickers(plan: List[Dict[str, Any]]) -> List[str]:
+    """收集计划中各步骤股票代码参数的取值"""
+    tickers = set()
+    for item in plan:
+        args = item.get("tool_args")
+        if isinstance(args, dict):
+            for key in _TICKER_KEYS:
+                if isinstance(args.get(key), str) and args[key].strip():
+                    tickers.add(args[key].strip())
+    return list(tickers)
+
+
+def _strip_specifics(value: Any, ticker_re: Optional[re.Pattern], key: str = None) -> Any:
+    """将参数值中的日期和已知股票代码替换为占位符"""
+    if isinstance(value, str):
+        if key in _TICKER_KEYS and value.strip():
+            return "{ticker}"
+        value = _DATE_RE.sub("{date}", value)
+        return ticker_re.sub("{ticker}", value) if ticker_re else value
+    if isinstance(value, dict):
+        return {k: _strip_specifics(v, ticker_re, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_strip_specifics(v, ticker_re, key) for v in value]
+    return value
+
+
+def make_template(plan: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    将具体计划抽象为模板（只处理tool_args，步骤描述和操作保持原样）
+
+    Args:
+        plan: 执行成功的计划
+
+    Returns:
+        参数中去除了日期、股票代码等具体实体的计划模板
+    """
+    tickers = _plan_tickers(plan)
+    # 其他参数（如新闻关键词）中出现的同一代码也替换为占位符，长代码优先匹配
+    ticker_re = re.compile(
+        r"(?<![A-Za-z0-9])(?:" + "|".join(map(re.escape, sorted(tickers, key=len, reverse=True))) + r")(?![A-Za-z0-9])"
+    ) if tickers else None
+    return [
+        {k: (_strip_specifics(v, ticker_re) if k == "tool_args" else v) for k, v in item.items()}
+        for item in plan
+    ]
+
+
+def store_plan(goal: str, plan: List[Dict[str, Any]]):
+    """
+    保存成功执行的计划模板
+
+    Args:
+        goal: 用户目标（原始输入）
+        plan: 执行成功的计划
+    """
+    if not goal or not plan:
+        return
+    try:
+        template = make_template(plan)
+        _get_collection().upsert(
+            ids=[hashlib.sha256(goal.encode("utf-8")).hexdigest()],
+            documents=[goal],
+            embeddings=[_embed(goal)],
+            metadatas=[{"template": dumps(template).decode("utf-8")}]
+        )
+        print(f"计划模板已缓存: {goal[:50]}")
+    except Exception as e:
+        print(f"计划模板缓存失败: {e}")
+
+
+def lookup(goal: str, threshold: float = DEFAULT_THRESHOLD) -> Optional[List[Dict[str, Any]]]:
+    """
+    查找与当前目标相似的计划模板
+
+    Args:
+        goal: 用户目标
+        threshold: 余弦相似度阈值
+
+    Returns:
+        命中的计划模板，未命中返回None
+    """
+    try:
+        collection = _get_collection()
+        if collection.count() == 0:
+            return None
+        results = collection.query(
+            query_embeddings=[_embed(goal)],
+            n_results=1,
+            include=["metadatas", "distances", "documents"]
+        )
+        if not results["ids"][0]:
+            return None
+
+        similarity = 1.0 - results["distances"][0][0]
+        if similarity < threshold:
+            return None
+
+        print(f"命中计划模板 (相似度 {similarity:.3f}): {results['documents'][0][0][:50]}")
+        return loads(results["metadatas"][0][0]["template"])
+    except Exception as e:
+        print(f"计划模板查询失败: {e}")
+        return None
@@ -1,18 +1,55 @@
 # utils/rag.py
 
 import os
+import re
 import json
-from typing import List, Dict, Any
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Dict, Any, Union
+import numpy as np
 from pypdf import PdfReader
+import torch
 from sentence_transformers import SentenceTransformer
 import tiktoken
 import chromadb
 from chromadb.utils import embedding_functions
 
-# 初始化 SentenceTransformer 模型
+# 尝试导入PyMuPDF（可选），C实现的PDF文本提取速度明显快于pypdf，未安装时使用pypdf
+try:
+    import fitz
+    has_fitz = True
+except ImportError:
+    has_fitz = False
+
+# SentenceTransformer 模型
 # 可以根据需求选择不同的模型，例如 'all-MiniLM-L6-v2' 或 'BAAI/bge-small-en-v1.5'
 # 这里我们使用一个通用的多语言模型，如果研报主要是中文，可以考虑使用中文模型
-model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+# 模型在首次使用时才加载，避免解析PDF的子进程导入本模块时重复加载
+EMBEDDING_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+# 推理后端（环境变量 EMBED_BACKEND）：torch（默认）、onnx 或 openvino；onnx/openvino 需安装 optimum 对应的扩展
+EMBED_BACKEND = os.environ.get("EMBED_BACKEND", "torch").lower()
+# onnx 后端使用的模型文件（环境变量 EMBED_ONNX_FILE），例如 CPU 上使用int8动态量化模型 onnx/model_qint8_avx512_vnni.onnx；
+# 未指定时使用 onnx/model.onnx，模型仓库中没有时由 sentence-transformers 自动导出
+EMBED_ONNX_FILE = os.environ.get("EMBED_ONNX_FILE")
+_model = None
+
+def get_model() -> SentenceTransformer:
+    """
+    获取（首次调用时加载）嵌入模型。
+    """
+    global _model
+    if _model is None:
+        # 有GPU时在GPU上以fp16推理，否则使用CPU fp32
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        if EMBED_BACKEND == "torch":
+            _model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=device)
+            if device == "cuda":
+                _model.half()
+        else:
+            model_kwargs = {"file_name": EMBED_ONNX_FILE} if EMBED_BACKEND == "onnx" and EMBED_ONNX_FILE else None
+            _model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=device, backend=EMBED_BACKEND, model_kwargs=model_kwargs)
+    return _model
 
 # 初始化 tiktoken 编码器
 # 可以根据实际使用的LLM选择合适的编码器，例如 'cl100k_base' 对应 OpenAI 的 GPT 系列
@@ -52,207 +89,392 @@ def reset_chroma_collection():
     
     return client.get_or_create_collection(name=COLLECTION_NAME)
 
-def load_and_preprocess_reports(reports_dir: str = "data/reports/") -> List[Dict[str, Any]]:
+def load_and_preprocess_reports(reports_dir: str = "data/reports/", max_workers: int = None) -> List[Dict[str, Any]]:
     """
-    加载指定目录下的研报，进行预处理（文本提取、分块、元数据提取），并生成嵌入向量。
-    支持 PDF 和 TXT/MD 文件。
+    加载指定目录下的研报，进行预处理（文本提取、分块、元数据提取）。
+    嵌入向量在 add_documents_to_chroma 中按批次统一生成。
+    支持 PDF 和 TXT/MD 文件，PDF 解析为 CPU 密集型操作，各文件在进程池中并行处理。
     
     功能升级：
     1. 识别类别：读取文件所在的子文件夹名作为 category。
     2. 解析文件名：从标准化的文件名 (Ticker_Date_Broker_Subject) 中提取元数据。
     3. 处理个股关联：标记是否为个股研报。
     """
-    processed_documents = []
-    
     # 确保路径存在
     if not os.path.exists(reports_dir):
         print(f"目录不存在: {reports_dir}")
         return []
 
     print(f"开始扫描目录: {reports_dir}")
-    for root, dirs, files in os.walk(reports_dir):
-        # 识别类别：读取文件所在的子文件夹名
-        # 如果 root 是 reports_dir 本身，category 为 "Uncategorized"
-        rel_path = os.path.relpath(root, reports_dir)
-        category = rel_path if rel_path != "." else "Uncategorized"
-        
-        for file_name in files:
-            # 跳过隐藏文件
-            if file_name.startswith('.'):
-                continue
-                
-            file_path = os.path.join(root, file_name)
-            content = ""
-            
-            # 提取文本
-            if file_name.endswith(".pdf"):
-                content = extract_text_from_pdf(file_path)
-            elif file_name.endswith(".txt") or file_name.endswith(".md"):
-                try:
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        content = f.read()
-                except Exception as e:
-                    print(f"读取文件失败 {file_path}: {e}")
-                    continue
-            else:
-                continue # 跳过不支持的文件类型
-            
-            if not content:
-                print(f"文件内容为空或无法读取: {file_name}")
-                continue
+    file_paths = []
+    categories = []
+    for entry, category in _iter_report_files(reports_dir):
+        file_paths.append(entry.path)
+        categories.append(category)
 
-            # 解析文件名元数据
-            # 智能解析：尝试寻找日期（8位数字）来定位其他字段
-            # 兼容格式：Ticker_Date_Broker_Subject 或 Code_Name_Date_Broker_Subject
-            name_without_ext = os.path.splitext(file_name)[0]
-            parts = name_without_ext.split('_')
-            
-            metadata = {
-                "source": file_name,
-                "category": category
-            }
-            
-            # 寻找日期（8位数字）
-            date_index = -1
-            for i, part in enumerate(parts):
-                if part.isdigit() and len(part) == 8:
-                    date_index = i
-                    break
-            
-            if date_index != -1:
-                metadata["publish_date"] = parts[date_index]
-                # Ticker 始终取第一部分
-                metadata["ticker"] = parts[0]
+    if not file_paths:
+        return []
+
+    processed_documents = []
+    # 每次向子进程派发4个文件，减少进程间通信次数；
+    # 本函数也会在Agent运行中（工作线程里，torch/httpx/asyncio线程都已启动）被调用，fork多线程进程可能死锁，因此用spawn启动子进程
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), mp_context=multiprocessing.get_context("spawn")) as executor:
+        for documents in executor.map(_parse_single_file, file_paths, categories, chunksize=4):
+            processed_documents.extend(documents)
                 
-                # Broker 通常在日期之后
-                if date_index + 1 < len(parts):
-                    metadata["broker"] = parts[date_index + 1]
-                else:
-                    metadata["broker"] = "UNKNOWN"
-                    
-                # Subject 是 Broker 之后的所有内容
-                if date_index + 2 < len(parts):
-                    metadata["subject"] = "_".join(parts[date_index + 2:])
-                else:
-                    metadata["subject"] = ""
-            elif len(parts) >= 3:
-                # 找不到日期时的回退逻辑：按位置解析
-                metadata["ticker"] = parts[0]
-                metadata["publish_date"] = parts[1]
-                metadata["broker"] = parts[2]
-                metadata["subject"] = "_".join(parts[3:]) if len(parts) > 3 else ""
+    return processed_documents
+
+def _iter_report_files(directory: str, rel_path: str = "") -> Iterator[tuple]:
+    """
+    递归扫描目录（os.scandir，DirEntry 自带文件名和类型信息，不再逐个调用 stat），
+    生成 (DirEntry, category)，category 为文件所在目录相对于研报根目录的路径，根目录下的文件为 "Uncategorized"。
+    """
+    category = rel_path or "Uncategorized"
+    subdirs = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry)
+            # 跳过隐藏文件和不支持的文件类型
+            elif not entry.name.startswith('.') and entry.name.endswith((".pdf", ".txt", ".md")) and entry.is_file():
+                yield entry, category
+    for entry in subdirs:
+        yield from _iter_report_files(entry.path, os.path.join(rel_path, entry.name) if rel_path else entry.name)
+
+# 标准研报文件名：Ticker_Date_Broker_Subject 或 Code_Name_Date_Broker_Subject（日期为第一个8位数字字段）
+_FNAME_RE = re.compile(r"^(?!\d{8}_)(?P<ticker>[^_]+)_(?:[^_]+_)??(?P<date>\d{8})_(?P<broker>[^_]+)(?:_(?P<subject>.+))?$", re.ASCII)
+
+def _parse_single_file(file_path: str, category: str) -> List[Dict[str, Any]]:
+    """
+    解析单个研报文件：提取文本、解析文件名元数据并分块（顶层函数，可被进程池序列化调用）。
+    """
+    processed_documents = []
+    file_name = os.path.basename(file_path)
+    
+    # 提取文本并分块（PDF逐页读取、边读边分块，不在内存中拼接整篇文本）
+    if file_name.endswith(".pdf"):
+        chunks = iter_text_chunks(iter_pdf_pages(file_path))
+    elif file_name.endswith(".txt") or file_name.endswith(".md"):
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                content = f.read()
+        except Exception as e:
+            print(f"读取文件失败 {file_path}: {e}")
+            return processed_documents
+        chunks = chunk_text(content)
+    else:
+        return processed_documents # 跳过不支持的文件类型
+
+    # 解析文件名元数据
+    # 智能解析：尝试寻找日期（8位数字）来定位其他字段
+    # 兼容格式：Ticker_Date_Broker_Subject 或 Code_Name_Date_Broker_Subject
+    name_without_ext = os.path.splitext(file_name)[0]
+    
+    metadata = {
+        "source": file_name,
+        "category": category
+    }
+    
+    m = _FNAME_RE.match(name_without_ext)
+    if m:
+        # 标准格式由一次正则匹配解析出各字段
+        metadata["publish_date"] = m.group("date")
+        metadata["ticker"] = m.group("ticker")
+        metadata["broker"] = m.group("broker")
+        metadata["subject"] = m.group("subject") or ""
+    else:
+        parts = name_without_ext.split('_')
+        
+        # 寻找日期（8位数字）
+        date_index = -1
+        for i, part in enumerate(parts):
+            if part.isdigit() and len(part) == 8:
+                date_index = i
+                break
+    
+        if date_index != -1:
+            metadata["publish_date"] = parts[date_index]
+            # Ticker 始终取第一部分
+            metadata["ticker"] = parts[0]
+        
+            # Broker 通常在日期之后
+            if date_index + 1 < len(parts):
+                metadata["broker"] = parts[date_index + 1]
             else:
-                # 无法解析标准格式时的回退
-                metadata["ticker"] = "UNKNOWN"
-                metadata["publish_date"] = "UNKNOWN"
                 metadata["broker"] = "UNKNOWN"
-                metadata["subject"] = name_without_ext
-
-            # 处理个股关联
-            # 如果 ticker 不是 INDUSTRY 或 MACRO，确保它能作为核心索引
-            if metadata["ticker"] not in ["INDUSTRY", "MACRO"]:
-                metadata["is_stock_specific"] = True
+            
+            # Subject 是 Broker 之后的所有内容
+            if date_index + 2 < len(parts):
+                metadata["subject"] = "_".join(parts[date_index + 2:])
             else:
-                metadata["is_stock_specific"] = False
+                metadata["subject"] = ""
+        elif len(parts) >= 3:
+            # 找不到日期时的回退逻辑：按位置解析
+            metadata["ticker"] = parts[0]
+            metadata["publish_date"] = parts[1]
+            metadata["broker"] = parts[2]
+            metadata["subject"] = "_".join(parts[3:]) if len(parts) > 3 else ""
+        else:
+            # 无法解析标准格式时的回退
+            metadata["ticker"] = "UNKNOWN"
+            metadata["publish_date"] = "UNKNOWN"
+            metadata["broker"] = "UNKNOWN"
+            metadata["subject"] = name_without_ext
 
-            # 分块并生成嵌入
-            chunks = chunk_text(content)
-            for i, chunk in enumerate(chunks):
-                embedding = model.encode(chunk).tolist()
-                
-                # 为每个 chunk 创建包含完整元数据的文档对象
-                doc_metadata = metadata.copy()
-                doc_metadata["chunk_id"] = i
-                
-                processed_documents.append({
-                    "id": f"{file_name}_{i}",
-                    "content": chunk,
-                    "embedding": embedding,
-                    "metadata": doc_metadata
-                })
-                
+    # 处理个股关联
+    # 如果 ticker 不是 INDUSTRY 或 MACRO，确保它能作为核心索引
+    if metadata["ticker"] not in ["INDUSTRY", "MACRO"]:
+        metadata["is_stock_specific"] = True
+    else:
+        metadata["is_stock_specific"] = False
+
+    # 生成文档块
+    for i, chunk in enumerate(chunks):
+        # 为每个 chunk 创建包含完整元数据的文档对象
+        doc_metadata = metadata.copy()
+        doc_metadata["chunk_id"] = i
+        
+        processed_documents.append({
+            "id": f"{file_name}_{i}",
+            "content": chunk,
+            "metadata": doc_metadata
+        })
+    
+    if not processed_documents:
+        print(f"文件内容为空或无法读取: {file_name}")
+        
     return processed_documents
 
 def extract_text_from_pdf(pdf_path: str) -> str:
     """
     从 PDF 文件中提取文本。
     """
-    text = ""
+    return "".join(iter_pdf_pages(pdf_path))
+
+def iter_pdf_pages(pdf_path: str) -> Iterator[str]:
+    """
+    逐页读取 PDF 文件的文本（优先使用 PyMuPDF）。
+    """
     try:
-        reader = PdfReader(pdf_path)
-        for page in reader.pages:
-            text += page.extract_text() or ""
+        if has_fitz:
+            with fitz.open(pdf_path) as doc:
+                for page in doc:
+                    text = page.get_text("text")
+                    if text:
+                        yield text
+        else:
+            # strict=False 跳过严格的结构校验，容忍轻微损坏的研报文件
+            reader = PdfReader(pdf_path, strict=False)
+            for page in reader.pages:
+                # 没有内容流的空白页无需调用文本提取
+                if page.get_contents() is None:
+                    continue
+                text = page.extract_text()
+                if text:
+                    yield text
     except Exception as e:
         print(f"Error reading PDF {pdf_path}: {e}")
-    return text
+
+def iter_text_chunks(texts: Iterable[str], max_tokens: int = 500, overlap: int = 50) -> Iterator[str]:
+    """
+    对连续的文本片段（如 PDF 的各页）流式分块，以 token 数量为基准，并支持重叠。
+    只在内存中保留当前窗口的 token，分块方式与 chunk_text 相同。
+    每读入一段文本后，把已凑满的窗口一次性批量解码（decode_batch 在 tiktoken 的 Rust 实现中完成）。
+    """
+    step = max_tokens - overlap
+    buffer = []
+    for text in texts:
+        buffer.extend(encoding.encode(text))
+        if len(buffer) >= max_tokens:
+            count = (len(buffer) - max_tokens) // step + 1
+            yield from encoding.decode_batch([buffer[k * step : k * step + max_tokens] for k in range(count)])
+            del buffer[:count * step]
+    # 剩余不足一个窗口的 token
+    yield from encoding.decode_batch([buffer[start : start + max_tokens] for start in range(0, len(buffer), step)])
 
 def chunk_text(text: str, max_tokens: int = 500, overlap: int = 50) -> List[str]:
     """
     将文本分块，以 token 数量为基准，并支持重叠。
     """
     tokens = encoding.encode(text)
-    chunks = []
-    for i in range(0, len(tokens), max_tokens - overlap):
-        chunk_tokens = tokens[i : i + max_tokens]
-        chunks.append(encoding.decode(chunk_tokens))
-    return chunks
+    # 不超过一个窗口的短文本直接返回原文，无需解码
+    if len(tokens) <= max_tokens:
+        return [text] if tokens else []
+    step = max_tokens - overlap
+    return encoding.decode_batch([tokens[start : start + max_tokens] for start in range(0, len(tokens), step)])
+
+# 文档块嵌入缓存文件：内容哈希 -> 嵌入向量，重新导入时未变化的文档块不再重新编码
+EMB_CACHE_PATH = os.environ.get("EMB_CACHE_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "emb_cache.npz"))
+
+def _embedding_key(text: str) -> str:
+    """嵌入缓存的键：模型名 + 文档块内容的 SHA-256（换模型后缓存自动失效）"""
+    return hashlib.sha256(f"{EMBEDDING_MODEL_NAME}\0{text}".encode("utf-8")).hexdigest()
+
+def load_embedding_cache(path: str = EMB_CACHE_PATH) -> Dict[str, np.ndarray]:
+    """
+    读取嵌入缓存文件，文件不存在或损坏时返回空缓存。
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with np.load(path) as data:
+            return dict(zip(data["keys"].tolist(), data["vectors"].astype(np.float32)))
+    except Exception as e:
+        print(f"读取嵌入缓存失败 {path}: {e}")
+        return {}
+
+def save_embedding_cache(cache: Dict[str, np.ndarray], path: str = EMB_CACHE_PATH):
+    """
+    将嵌入缓存写入文件（键和向量分别保存为两个数组）。
+    向量以 float16 保存，文件大小减半；余弦相似度排序几乎不受影响，读取时再转换回 float32。
+    """
+    if not cache:
+        return
+    np.savez_compressed(path, keys=np.array(list(cache.keys())), vectors=np.stack(list(cache.values())).astype(np.float16))
+
+def _encode_documents(texts: List[str], batch_size: int, cache: Dict[str, np.ndarray] = None, used_keys: set = None) -> np.ndarray:
+    """
+    批量生成文档块的嵌入向量，返回 (n, dim) 的连续 float32 ndarray；提供缓存时只编码未命中的文档块，
+    并把本批用到的缓存键记入 used_keys。
+    （GPU fp16 推理时输出为 float16，这里统一转换为 Chroma 存储使用的 float32）
+    """
+    if cache is None:
+        return np.ascontiguousarray(get_model().encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ), dtype=np.float32)
+    
+    keys = [_embedding_key(text) for text in texts]
+    if used_keys is not None:
+        used_keys.update(keys)
+    missing = [i for i, key in enumerate(keys) if key not in cache]
+    if missing:
+        vectors = np.asarray(get_model().encode(
+            [texts[i] for i in missing],
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ), dtype=np.float32)
+        for i, vector in zip(missing, vectors):
+            cache[keys[i]] = vector
+    return np.stack([cache[key] for key in keys])
 
-def add_documents_to_chroma(documents: List[Dict[str, Any]], collection):
+def _add_batch_to_chroma(collection, batch_label: str, ids: List[str], embeddings: np.ndarray,
+                         metadatas: List[Dict[str, Any]], documents_content: List[str]):
+    """
+    写入一个批次到 ChromaDB 集合（在后台写入线程中执行，失败时只打印错误，不影响后续批次）。
+    """
+    try:
+        collection.add(
+            embeddings=embeddings,
+            metadatas=metadatas,
+            documents=documents_content,
+            ids=ids
+        )
+        print(f"  批次 {batch_label} 完成（{len(ids)} 个文档块）")
+    except Exception as e:
+        print(f"添加批次 {batch_label} 失败: {e}")
+
+def add_documents_to_chroma(documents: List[Dict[str, Any]], collection, batch_size: int = 64, add_batch_size: int = 5000,
+                            use_embedding_cache: bool = True):
     """
     将处理后的文档块添加到 ChromaDB 集合中。
+    每 add_batch_size 个文档块写入一次集合（减少提交次数），写入前以 batch_size 为推理批大小统一生成嵌入向量
+    （已带 embedding 的文档直接使用）。
+    use_embedding_cache 为 True 时按内容哈希复用 EMB_CACHE_PATH 中已有的嵌入向量，只编码新增或变化的文档块；
+    回写时只保留本次文档集合用到的条目，已删除或已变化的文档块不会在缓存文件中无限累积。
+    写入在单独的后台线程中进行：当前批次写入磁盘的同时编码下一批次，且最多只有一个批次在等待写入。
     """
     if not documents:
         print("没有文档需要添加")
         return
     
-    # 批量添加，避免一次性过大
-    batch_size = 100
+    emb_cache = load_embedding_cache() if use_embedding_cache else None
+    used_keys = set()
+    
     total_docs = len(documents)
+    total_batches = (total_docs + add_batch_size - 1) // add_batch_size
     
-    print(f"准备添加 {total_docs} 个文档块到 ChromaDB...")
+    print(f"准备添加 {total_docs} 个文档块到 ChromaDB，共 {total_batches} 个批次（每批最多 {add_batch_size} 个）...")
     
-    for i in range(0, total_docs, batch_size):
-        batch = documents[i : i + batch_size]
-        
-        ids = [doc["id"] for doc in batch]
-        embeddings = [doc["embedding"] for doc in batch]
-        metadatas = [doc["metadata"] for doc in batch] # 使用完整的 metadata
-        documents_content = [doc["content"] for doc in batch]
-        
-        try:
-            collection.add(
-                embeddings=embeddings,
-                metadatas=metadatas,
-                documents=documents_content,
-                ids=ids
-            )
-        except Exception as e:
-            print(f"添加批次 {i//batch_size} 失败: {e}")
+    # 单个写入线程保证批次按顺序写入；模型推理和 Chroma 写入都会释放 GIL，两者可以重叠
+    pending = None
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        for batch_index, i in enumerate(range(0, total_docs, add_batch_size), 1):
+            batch = documents[i : i + add_batch_size]
+            batch_label = f"{batch_index}/{total_batches}"
+            
+            ids = [doc["id"] for doc in batch]
+            metadatas = [doc["metadata"] for doc in batch] # 使用完整的 metadata
+            documents_content = [doc["content"] for doc in batch]
             
+            try:
+                if all("embedding" in doc for doc in batch):
+                    # 已带嵌入向量的文档同样堆叠为一个 float32 ndarray 再写入
+                    embeddings = np.asarray([doc["embedding"] for doc in batch], dtype=np.float32)
+                else:
+                    # 直接得到 (n, dim) 的连续 float32 ndarray 传给 Chroma，不再转换为嵌套列表
+                    embeddings = _encode_documents(documents_content, batch_size, emb_cache, used_keys)
+            except Exception as e:
+                print(f"添加批次 {batch_label} 失败: {e}")
+                continue
+            
+            # 等待上一批次写完再提交，限制内存中待写入的嵌入向量
+            if pending is not None:
+                pending.result()
+            pending = writer.submit(_add_batch_to_chroma, collection, batch_label, ids, embeddings, metadatas, documents_content)
+    
     print(f"成功向 ChromaDB 添加 {total_docs} 个文档块。")
+    
+    # 缓存内容有变化（新编码了文档块或有条目不再使用）时才回写缓存文件
+    if emb_cache is not None and used_keys and emb_cache.keys() != used_keys:
+        save_embedding_cache({key: emb_cache[key] for key in used_keys if key in emb_cache})
 
-def query_chroma(query_text: str, collection, n_results: int = 5, where: Dict = None) -> List[Dict[str, Any]]:
+def query_chroma(query_text: Union[str, List[str]], collection, n_results: int = 5, where: Dict = None) -> Union[List[Dict[str, Any]], List[List[Dict[str, Any]]]]:
     """
     根据查询文本在 ChromaDB 中进行相似性搜索，返回最相关的文档块。
     支持通过 where 参数进行元数据过滤。
+    query_text 为列表时，所有查询一次编码、一次查询，按查询顺序返回每个查询的结果列表。
     """
-    query_embedding = model.encode([query_text]).tolist()
+    if isinstance(query_text, str):
+        # 单条查询直接编码为一维向量再变形为 (1, dim)，不走列表批处理路径
+        queries = [query_text]
+        query_embeddings = np.asarray(get_model().encode(
+            query_text,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ), dtype=np.float32).reshape(1, -1)
+    else:
+        queries = list(query_text)
+        if not queries:
+            return []
+        query_embeddings = np.asarray(get_model().encode(
+            queries,
+            batch_size=32,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ), dtype=np.float32)
     
     results = collection.query(
-        query_embeddings=query_embedding,
+        query_embeddings=query_embeddings,
         n_results=n_results,
         where=where,
         include=['documents', 'metadatas']
     )
     
-    retrieved_docs = []
-    if results and results['documents']:
-        for i in range(len(results['documents'][0])):
-            retrieved_docs.append({
-                "content": results['documents'][0][i],
-                "metadata": results['metadatas'][0][i]
-            })
-    return retrieved_docs
+    retrieved = []
+    for q in range(len(queries)):
+        retrieved_docs = []
+        if results and results['documents']:
+            for content, metadata in zip(results['documents'][q], results['metadatas'][q]):
+                retrieved_docs.append({
+                    "content": content,
+                    "metadata": metadata
+                })
+        retrieved.append(retrieved_docs)
+    return retrieved[0] if isinstance(query_text, str) else retrieved
 
 # 示例用法 (可以在其他地方调用)
 if __name__ == "__main__":
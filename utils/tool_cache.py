@@ -0,0 +1,107 @@
+"""
+创建日期：2026年10月15日
+介绍：工具调用结果缓存 - 按(工具名, 规范化参数)精确匹配，按工具和数据类型设置不同的有效期
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from .json_utils import dumps
+
+TOOL_CACHE_SIZE = 1024
+
+# 各工具结果的有效期（秒），未列出的工具不缓存（如get_current_time、generate_markdown_report、batch_execute）
+_TOOL_TTL = {
+    "retrieve_reports": 3600.0,
+    "stock_data": 300.0,
+    "SearchFinancialNews": 300.0,
+}
+# akshare_search按数据类型区分：实时行情很快过期，历史数据和基本信息一天内基本不变
+_AKSHARE_TTL = {
+    "realtime": 60.0,
+    "history": 86400.0,
+    "info": 86400.0,
+}
+
+_cache: "OrderedDict[bytes, tuple]" = OrderedDict()  # key -> (过期时间, 结果)
+_lock = threading.Lock()
+
+
+def tool_cache_enabled() -> bool:
+    """是否启用工具结果缓存（默认启用，环境变量 TOOL_CACHE=0 时关闭）"""
+    return os.environ.get("TOOL_CACHE", "1") != "0"
+
+
+def tool_ttl(tool_name: str, args: Dict[str, Any]) -> Optional[float]:
+    """
+    获取工具调用结果的有效期
+
+    Args:
+        tool_name: 工具名
+        args: 工具参数
+
+    Returns:
+        有效期（秒），不应缓存时返回None
+    """
+    if tool_name == "akshare_search":
+        data_type = args.get("data_type")
+        if data_type == "history" and not args.get("end_date"):
+            # 未指定结束日期时区间截至今天，当天的行情仍在变化，按实时行情的有效期缓存
+            return _AKSHARE_TTL["realtime"]
+        return _AKSHARE_TTL.get(data_type)
+    return _TOOL_TTL.get(tool_name)
+
+
+def _normalize(value: Any) -> Any:
+    """规范化参数值：去除字符串首尾空白，并丢弃值为None的参数（与不传该参数等价）"""
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def tool_cache_key(tool_name: str, args: Dict[str, Any]) -> bytes:
+    """生成稳定的缓存键：工具名 + 规范化参数（按键排序）"""
+    return dumps({"tool": tool_name, "args": _normalize(args or {})}, sort_keys=True)
+
+
+def get_cached_result(key: bytes) -> Any:
+    """
+    查询缓存
+
+    Args:
+        key: tool_cache_key生成的缓存键
+
+    Returns:
+        未过期的缓存结果，未命中时返回None
+    """
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return entry[1]
+
+
+def set_cached_result(key: bytes, result: Any, ttl: float):
+    """写入缓存，超出容量时淘汰最久未使用的条目"""
+    with _lock:
+        _cache[key] = (time.monotonic() + ttl, result)
+        _cache.move_to_end(key)
+        while len(_cache) > TOOL_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def clear_tool_cache():
+    """清空工具结果缓存"""
+    with _lock:
+        _cache.clear()
@@ -2,51 +2,69 @@
 创建日期：2026年02月11日
 介绍：
 """
-from typing import List, Dict, Any
-import json
+from typing import AsyncIterator, List, Dict, Any, Optional
 import asyncio
+from contextlib import aclosing
 
 from utils.config import load_config
 from fastmcp import Client
-from .mcp import get_local_mcp_client
+from .mcp import get_local_mcp_client, get_remote_mcp_session
+from .json_utils import loads
+from .tool_cache import tool_cache_enabled, tool_ttl, tool_cache_key, get_cached_result, set_cached_result
 
 
 config = load_config()
-local_mcp_tools = {"add", "akshare_search", "generate_markdown_report", "retrieve_reports"}
+local_mcp_tools = {"add", "akshare_search", "get_current_time", "generate_markdown_report", "retrieve_reports", "batch_execute"}
 qieman_mcp_tools = {"SearchFinancialNews"}
 finmcp_mcp_tools = {"stock_data", "index_data"}
 
 
 
 async def _call_tool_async(tool_name: str, args: Dict[str, Any]) -> str:
-    """异步调用MCP工具，包含参数检查"""
+    """异步调用MCP工具；行情、研报等查询结果按工具设置的有效期缓存（见 utils/tool_cache.py）"""
+    ttl = tool_ttl(tool_name, args) if tool_cache_enabled() else None
+    if ttl is None:
+        result, _ = await _dispatch_tool_async(tool_name, args)
+        return result
+
+    key = tool_cache_key(tool_name, args)
+    result = get_cached_result(key)
+    if result is None:
+        # 延迟导入，避免循环依赖（nodes模块依赖本模块）
+        from .nodes import is_failed_result
+
+        # 只缓存成功的调用：调用失败时异常直接抛给调用方；远程工具返回的错误、
+        # 以及带失败标记的结果（如多只股票查询中部分代码失败）原样返回但不缓存
+        result, is_error = await _dispatch_tool_async(tool_name, args)
+        if not is_error and not is_failed_result(result):
+            set_cached_result(key, result, ttl)
+    return result
+
+
+async def _dispatch_tool_async(tool_name: str, args: Dict[str, Any]) -> tuple[Any, bool]:
+    """按工具所属的MCP服务器分发调用，返回 (结果, 是否为工具返回的错误)"""
     if tool_name in local_mcp_tools:
-        # 本地 MCP 服务器调用工具
+        # 本地 MCP 服务器调用工具（工具出错时fastmcp客户端直接抛出异常）
         local_mcp_client = get_local_mcp_client()
         async with local_mcp_client:
             result = await local_mcp_client.call_tool(tool_name, args)
-            return result
+            return result, False
     elif tool_name in qieman_mcp_tools:
-        # 远程 且慢MCP 服务器调用工具
-        MCP_URL = config["mcpServers"]["qieman"]
-        from mcp.client.session import ClientSession
-        from mcp.client.sse import sse_client
-
-        async with sse_client(MCP_URL) as (read, write):
-            async with ClientSession(read, write) as session:
-                response = await session.call_tool(tool_name, args)
-                result = json.loads(response.content[0].text)
-        return result
+        # 远程 且慢MCP 服务器调用工具（复用已建立的会话）
+        session = await get_remote_mcp_session(config["mcpServers"]["qieman"])
+        response = await session.call_tool(tool_name, args)
+        if response.isError:
+            # 错误结果是提示文本而不是JSON
+            return response.content[0].text, True
+        result = loads(response.content[0].text)
+        return result, False
     elif tool_name in finmcp_mcp_tools:
-        # 远程 FinanceMCP 服务器调用工具
-        MCP_URL = config["mcpServers"]["finmcp"]
-        from mcp.client.session import ClientSession
-        from mcp.client.sse import sse_client
-        async with sse_client(MCP_URL) as (read, write):
-            async with ClientSession(read, write) as session:
-                response = await session.call_tool(tool_name, args)
-                result = response.content[0].text
-        return result
+        # 远程 FinanceMCP 服务器调用工具（复用已建立的会话）
+        session = await get_remote_mcp_session(config["mcpServers"]["finmcp"])
+        response = await session.call_tool(tool_name, args)
+        result = response.content[0].text
+        return result, bool(response.isError)
+    return None, False
 
 
 def parse_plan(plan_content: str) -> List[str]:
@@ -89,29 +107,66 @@ def parse_tool_call(command: str) -> tuple[str, dict]:
     _, tool_info = command.split(":", 1)
     tool_name, args_str = tool_info.strip().split(" ", 1)
 
-    # 将参数字符串解析为字典
+    # 将参数字符串解析为字典（orjson与标准库json的解析错误均为ValueError子类）
     try:
-        args = json.loads(args_str)
-    except json.JSONDecodeError as e:
+        args = loads(args_str)
+    except ValueError as e:
         raise ValueError(f"Invalid JSON format in tool arguments: {args_str}") from e
 
     return tool_name, args
 
 
-def generate_text(prompt: str) -> str:
-    """调用LLM模型生成文本"""
+def _build_messages(prompt: str, prefix: Optional[str] = None) -> List[Dict[str, str]]:
+    """构造消息列表：静态前缀作为首条system消息，动态内容作为user消息（Gemini客户端会把两者原样拼接为一个提示词）"""
+    if prefix:
+        return [{"role": "system", "content": prefix}, {"role": "user", "content": prompt}]
+    return [{"role": "user", "content": prompt}]
+
+
+def generate_text(prompt: str, prefix: Optional[str] = None, use_cache: bool = True) -> str:
+    """
+    调用LLM模型生成文本
+
+    prefix为跨调用不变的静态提示（规则、示例、工具定义等），始终放在请求最前面，
+    使Ollama可复用上次请求已计算的前缀KV缓存、Gemini命中隐式前缀缓存；
+    use_cache为False时本次调用跳过LLM响应缓存（缓存本身由环境变量 LLM_CACHE=1 开启，见 llm/cache.py）
+    """
     # 重新加载配置以获取最新的provider设置
     provider = config.get("llm_provider", "ollama")
     
     if provider == "gemini":
         from llm.gemini_client import gemini_chat
-        return gemini_chat(prompt)
+        return gemini_chat(_build_messages(prompt, prefix) if prefix else prompt, use_cache=use_cache)
     else:
         # 默认使用Ollama
         from llm.ollama_client import ollama_chat
-        messages = [{"role": "user", "content": prompt}]
-        return ollama_chat(messages)
+        return ollama_chat(_build_messages(prompt, prefix), use_cache=use_cache)
+
+
+async def generate_text_async(prompt: str, prefix: Optional[str] = None, use_cache: bool = True) -> str:
+    """异步调用LLM模型生成文本，供异步节点并发调用（prefix、use_cache含义同generate_text）"""
+    provider = config.get("llm_provider", "ollama")
+
+    if provider == "gemini":
+        from llm.gemini_client import gemini_chat_async
+        return await gemini_chat_async(_build_messages(prompt, prefix) if prefix else prompt, use_cache=use_cache)
+    else:
+        from llm.ollama_client import ollama_chat_async
+        return await ollama_chat_async(_build_messages(prompt, prefix), use_cache=use_cache)
 
 
+async def generate_text_stream_async(prompt: str, prefix: Optional[str] = None, use_cache: bool = True) -> AsyncIterator[str]:
+    """异步流式调用LLM模型，逐段返回生成的文本（prefix、use_cache含义同generate_text）"""
+    provider = config.get("llm_provider", "ollama")
 
+    if provider == "gemini":
+        from llm.gemini_client import gemini_chat_stream_async
+        stream = gemini_chat_stream_async(_build_messages(prompt, prefix) if prefix else prompt, use_cache=use_cache)
+    else:
+        from llm.ollama_client import ollama_chat_stream_async
+        stream = ollama_chat_stream_async(_build_messages(prompt, prefix), use_cache=use_cache)
 
+    # 调用方提前停止读取时立即关闭底层流（中断HTTP响应），而不是等垃圾回收
+    async with aclosing(stream):
+        async for chunk in stream:
+            yield chunk